@@ -0,0 +1,54 @@
+import json
+
+import numpy as np
+from mesa.visualization.ModularVisualization import VisualizationElement
+
+
+def _list(values):
+    return [None if np.isnan(v) else float(v) for v in values]
+
+
+class AggregatedChartModule(VisualizationElement):
+    """
+    Line chart of model reporters read from the model's downsampled series
+    (model.charts, see downsample.py) instead of the DataCollector.
+
+    Every render sends the whole chart, at most chart_points buckets per
+    series with their mean as the line and their min/max as a band, and
+    the browser replaces its data instead of appending to it. Both the
+    message and the drawing stay the same size however long the run is.
+    Falls back to the latest DataCollector value (like ChartModule) when
+    the model keeps no series.
+    """
+    local_includes = ["boid_flockers/aggregated_chart.js"]
+    package_includes = ["Chart.min.js"]
+
+    def __init__(self, series, canvas_height=200, canvas_width=500,
+                 data_collector_name="datacollector"):
+        self.series = series
+        self.canvas_height = canvas_height
+        self.canvas_width = canvas_width
+        self.data_collector_name = data_collector_name
+        new_element = "new AggregatedChartModule({}, {}, {})".format(
+            json.dumps(self.series), canvas_width, canvas_height)
+        self.js_code = "elements.push(" + new_element + ");"
+
+    def render(self, model):
+        charts = getattr(model, "charts", None)
+        if charts is None:
+            data_collector = getattr(model, self.data_collector_name)
+            values = []
+            for s in self.series:
+                try:
+                    values.append(data_collector.model_vars[s["Label"]][-1])
+                except (IndexError, KeyError):
+                    values.append(0)
+            return {"step": model.schedule.steps, "last": values}
+
+        data = {"x": None, "series": []}
+        for s in self.series:
+            start, lo, mean, hi = charts.get(s["Label"])
+            data["x"] = start.tolist()
+            data["series"].append({"min": _list(lo), "mean": _list(mean),
+                                   "max": _list(hi)})
+        return data
@@ -0,0 +1,147 @@
+"""
+Accumulators
+=============================================================
+Running totals of the measurement box and of the completed flights.
+
+Instead of scanning every agent when the reporters run, the model keeps
+totals that are updated only where something changes:
+
+    - a boid is placed or removed: its share of the box totals (occupancy,
+      total and effective flow) is added or subtracted;
+    - a boid moves (Boid.step): the difference between its share before and
+      after the move is applied, and the distance flown is added to VKT;
+    - a boid leaves the airspace: its enroute delay and travel time are
+      computed once, added to the delay totals and the travel-time
+      histogram, and recorded per agent.
+
+The vector engine moves every boid at once and recounts the box with
+array operations instead (recount).
+
+The free-flow end time of a flight only depends on its entry time and OD
+distance, so it is set once on entry, and the enroute delay once on exit,
+instead of on every step.
+"""
+import numpy as np
+import pandas as pd
+
+from .metrics import in_box, measurement_box
+
+
+class Accumulators:
+    """
+    Box totals, cumulative traffic measures and per-flight delays.
+
+    Args:
+        box: (x_lo, x_hi, y_lo, y_hi) measurement box.
+        bin_width: Width of the travel-time histogram bins, in steps.
+    """
+
+    record_columns = ("unique_id", "init_time", "entry_time", "exit_time",
+                      "od_dist", "dep_del", "enroute_del", "travel_time")
+
+    def __init__(self, box, bin_width=10):
+        self.box = box
+        self.bin_width = bin_width
+        self.occupancy = 0
+        self.flow = 0.0
+        self.eff_flow = 0.0
+        self.occupancy_time = 0
+        self.vkt = 0.0
+        self.travel_time = 0.0
+        self.completed = 0
+        self.histogram = np.zeros(0, dtype=np.int64)
+        self.records = []
+
+    @classmethod
+    def for_model(cls, model, bin_width=10):
+        return cls(measurement_box(model), bin_width)
+
+    def inside(self, pos):
+        x_lo, x_hi, y_lo, y_hi = self.box
+        return x_lo <= pos[0] <= x_hi and y_lo <= pos[1] <= y_hi
+
+    def share(self, agent):
+        """
+        The agent's contribution to the box totals.
+        """
+        if not self.inside(agent.pos):
+            return (0, 0.0, 0.0)
+        return (1, float(agent.physic_speed), float(agent.effective_speed))
+
+    def add(self, share, sign=1):
+        self.occupancy += sign*share[0]
+        self.flow += sign*share[1]
+        self.eff_flow += sign*share[2]
+
+    def moved(self, agent, before, old_pos):
+        """
+        Apply the change of an agent's share after its step. before is
+        share(agent) and old_pos its position from before the step.
+        """
+        after = self.share(agent)
+        self.occupancy += after[0] - before[0]
+        self.flow += after[1] - before[1]
+        self.eff_flow += after[2] - before[2]
+        dx, dy = agent.pos[0] - old_pos[0], agent.pos[1] - old_pos[1]
+        self.vkt += float(np.sqrt(dx*dx + dy*dy))
+
+    def recount(self, pos, physic_speed, effective_speed, travelled=0.0):
+        """
+        Set the box totals from the arrays of all placed boids.
+        """
+        mask = in_box(pos, self.box)
+        self.occupancy = int(np.count_nonzero(mask))
+        self.flow = float(physic_speed[mask].sum())
+        self.eff_flow = float(effective_speed[mask].sum())
+        self.vkt += float(travelled)
+
+    def entered(self, agent):
+        """
+        A queued agent took off at agent.entry_time.
+        """
+        agent.freeflow_endtime = agent.entry_time + agent.od_dist/agent.speed
+
+    def exited(self, agent, time):
+        """
+        An agent reached its destination in the step that started at time.
+
+        Returns:
+            Its enroute delay.
+        """
+        enroute_del = max(time - agent.freeflow_endtime, 0)
+        agent.enroute_del = enroute_del
+        travel_time = time + 1 - agent.entry_time
+        self.travel_time += travel_time
+        self.completed += 1
+
+        k = int(travel_time//self.bin_width)
+        if k >= len(self.histogram):
+            grown = np.zeros(max(k + 1, 2*len(self.histogram)), dtype=np.int64)
+            grown[:len(self.histogram)] = self.histogram
+            self.histogram = grown
+        self.histogram[k] += 1
+
+        self.records.append((agent.unique_id, agent.init_time,
+                             agent.entry_time, time + 1, agent.od_dist,
+                             agent.entry_time - agent.init_time, enroute_del,
+                             travel_time))
+        return enroute_del
+
+    def end_step(self):
+        self.occupancy_time += self.occupancy
+
+    def mean_travel_time(self):
+        return self.travel_time/self.completed if self.completed else None
+
+    def travel_time_histogram(self):
+        """
+        Series of flight counts indexed by the lower edge of each bin.
+        """
+        edges = np.arange(len(self.histogram))*self.bin_width
+        return pd.Series(self.histogram, index=edges, name="flights")
+
+    def agent_delays(self):
+        """
+        One row per completed flight with its times and delays.
+        """
+        return pd.DataFrame(self.records, columns=self.record_columns)
@@ -0,0 +1,185 @@
+"""
+Adaptive sweeps
+=============================================================
+Rate sweep that places its runs where the MFD is informative.
+
+A fixed rate grid spends most of its runs in free flow or gridlock, where
+the fundamental diagram is flat. The planner starts from a coarse grid and
+keeps a pool of worker processes busy: whenever a worker frees up, it
+scores every gap between neighboring rates that have finished and runs the
+midpoint of the best one. A gap scores high when the occupancy-flow curve
+bends at its ends (around capacity) or when flow varies a lot between
+replications there, weighted by the gap's width so that no single gap is
+refined forever.
+
+    index, points = run_adaptive_sweep((10, 100, 200, 400), fixed_params,
+                                       iterations=3, max_runs=60)
+
+Every run is written like a run_sweep run (model_<id>.csv plus index.csv),
+so load_sweep reads the result back. points.csv holds one row per rate
+with the mean and standard deviation of the settled occupancy and flow.
+"""
+import os
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import numpy as np
+import pandas as pd
+
+from .sweep import _run_task
+
+
+def run_seed(seed, rate, iteration):
+    """
+    Seed of one run, derived from the sweep seed, the rate and the
+    replication so it does not depend on the order runs were planned in.
+    """
+    key = [seed, int(round(rate*1000)), iteration]
+    return int(np.random.SeedSequence(key).generate_state(1)[0])
+
+
+def point_table(summaries):
+    """
+    Aggregate run summaries into one row per rate.
+    """
+    runs = pd.DataFrame(summaries)
+    points = runs.groupby("rate").agg(
+        runs=("run_id", "count"),
+        occupancy=("occupancy", "mean"),
+        occupancy_std=("occupancy", "std"),
+        flow=("flow", "mean"),
+        flow_std=("flow", "std"))
+    return points.fillna(0).reset_index()
+
+
+def gap_scores(points, curvature_weight=1.0, variance_weight=1.0):
+    """
+    Refinement score of every gap between neighboring finished rates.
+
+    Args:
+        points: point_table of the finished rates.
+
+    Returns:
+        Array of len(points) - 1 scores, gap k lying between points k and
+        k + 1 in rate order.
+    """
+    rate = points["rate"].to_numpy(float)
+    k = points["occupancy"].to_numpy(float)
+    q = points["flow"].to_numpy(float)
+    if len(rate) < 2:
+        return np.zeros(0)
+    k = k/max(k.max(), 1e-9)
+    q = q/max(q.max(), 1e-9)
+    spread = points["flow_std"].to_numpy(float)/max(q.max(), 1e-9)
+
+    # Turning angle of the normalized occupancy-flow polyline at every
+    # point; the end points get the angle of their only neighbor.
+    heading = np.arctan2(np.diff(q), np.diff(k))
+    turn = np.zeros(len(rate))
+    if len(rate) > 2:
+        bend = np.abs(np.angle(np.exp(1j*np.diff(heading))))
+        turn[1:-1] = bend
+        turn[0], turn[-1] = bend[0], bend[-1]
+
+    width = np.diff(rate)/(rate[-1] - rate[0])
+    curvature = np.maximum(turn[:-1], turn[1:])/np.pi
+    variance = (spread[:-1] + spread[1:])/2
+    return (curvature_weight*curvature + variance_weight*variance +
+            1e-3)*width
+
+
+def run_adaptive_sweep(
+        rates,
+        fixed_params=None,
+        iterations=3,
+        max_runs=60,
+        min_spacing=1,
+        max_steps=1200,
+        out_dir="adaptive_output",
+        workers=None,
+        seed=0,
+        agent_data=False,
+        fmt="csv",
+        curvature_weight=1.0,
+        variance_weight=1.0):
+    """
+    Run an adaptive rate sweep on a process pool.
+
+    Args:
+        rates: Coarse initial rate grid.
+        fixed_params: BoidFlockers arguments shared by all runs, e.g.
+                {"vision": 4, "separation": 1, "monitor": True}.
+        iterations: Replications per rate.
+        max_runs: Total run budget, initial grid included.
+        min_spacing: Gaps narrower than this are not split any further.
+        max_steps, out_dir, workers, agent_data, fmt: See run_sweep.
+        seed: Sweep seed the per-run seeds are derived from.
+        curvature_weight, variance_weight: Weights of the two terms of the
+                gap score (see gap_scores).
+
+    Returns:
+        (index, points): one row per run, and one row per rate.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    fixed_params = fixed_params or {}
+    workers = workers or os.cpu_count() or 1
+
+    planned = []          # rates in the order they were scheduled
+    pending = {}          # rate -> number of unfinished runs
+    summaries = []
+    run_id = 0
+
+    def schedule(pool, rate):
+        nonlocal run_id
+        futures = []
+        for iteration in range(iterations):
+            if run_id >= max_runs:
+                break
+            params = dict(fixed_params, rate=rate)
+            run = {"run_id": run_id, "iteration": iteration,
+                   "seed": run_seed(seed, rate, iteration), "params": params}
+            futures.append(pool.submit(
+                _run_task, (run, max_steps, out_dir, agent_data, fmt)))
+            run_id += 1
+        planned.append(rate)
+        pending[rate] = len(futures)
+        return futures
+
+    def refinement():
+        finished = [s for s in summaries if pending[s["rate"]] == 0]
+        if not finished:
+            return None
+        points = point_table(finished)
+        scores = gap_scores(points, curvature_weight, variance_weight)
+        rate = points["rate"].to_numpy(float)
+        for k in np.argsort(-scores):
+            if rate[k + 1] - rate[k] < 2*min_spacing:
+                continue
+            midpoint = (rate[k] + rate[k + 1])/2
+            if midpoint not in pending:
+                return midpoint
+        return None
+
+    with ProcessPoolExecutor(workers) as pool:
+        running = set()
+        for rate in sorted(set(rates)):
+            running.update(schedule(pool, rate))
+        while running:
+            done, running = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                summary = future.result()
+                summaries.append(summary)
+                pending[summary["rate"]] -= 1
+            # Top the pool up with refinements while the budget lasts.
+            while len(running) < workers and run_id < max_runs:
+                rate = refinement()
+                if rate is None:
+                    break
+                running.update(schedule(pool, rate))
+
+    index = pd.DataFrame(summaries).sort_values("run_id")
+    index = index.reset_index(drop=True)
+    index.to_csv(os.path.join(out_dir, "index.csv"), index=False)
+    points = point_table(summaries)
+    points["order"] = [planned.index(r) for r in points["rate"]]
+    points.to_csv(os.path.join(out_dir, "points.csv"), index=False)
+    return index, points
@@ -0,0 +1,76 @@
+var AggregatedChartModule = function(series, canvas_width, canvas_height) {
+	// Create the tag:
+	var canvas_tag = "<canvas width='" + canvas_width + "' height='" + canvas_height + "' ";
+	canvas_tag += "style='border:1px dotted'></canvas>";
+	var canvas = $(canvas_tag)[0];
+	$("#elements").append(canvas);
+	var context = canvas.getContext("2d");
+
+	// Any CSS color as a translucent rgba() for the min/max band.
+	var translucent = function(color) {
+		context.fillStyle = color;
+		var hex = context.fillStyle;
+		if (hex.indexOf('#') != 0)
+			return 'rgba(0,0,0,0.1)';
+		var r = parseInt(hex.substring(1, 3), 16);
+		var g = parseInt(hex.substring(3, 5), 16);
+		var b = parseInt(hex.substring(5, 7), 16);
+		return 'rgba(' + r + ',' + g + ',' + b + ',0.2)';
+	};
+
+	// Three datasets per series: the min/max band (max filled down to min)
+	// and the mean line on top.
+	var datasets = [];
+	for (var i in series) {
+		var s = series[i];
+		datasets.push({label: s.Label + " max", data: [], borderWidth: 0,
+			pointRadius: 0, backgroundColor: translucent(s.Color),
+			borderColor: "transparent", fill: "+1"});
+		datasets.push({label: s.Label + " min", data: [], borderWidth: 0,
+			pointRadius: 0, borderColor: "transparent", fill: false});
+		datasets.push({label: s.Label, data: [], borderColor: s.Color,
+			backgroundColor: s.Color, pointRadius: 0, fill: false});
+	}
+
+	var chart = new Chart(context, {
+		type: 'line',
+		data: {labels: [], datasets: datasets},
+		options: {
+			responsive: true,
+			animation: false,
+			plugins: {legend: {labels: {filter: function(item) {
+				return !/ (min|max)$/.test(item.text);
+			}}}},
+			scales: {x: {ticks: {maxTicksLimit: 11}}}
+		}
+	});
+
+	// data is either the full downsampled chart ({x, series}) or, when the
+	// model keeps no series, the latest values ({step, last}) to append.
+	this.render = function(data) {
+		if (data === null || data === undefined)
+			return;
+		if (data.x === undefined) {
+			chart.data.labels.push(data.step);
+			for (var i = 0; i < data.last.length; i++) {
+				chart.data.datasets[3*i].data.push(data.last[i]);
+				chart.data.datasets[3*i + 1].data.push(data.last[i]);
+				chart.data.datasets[3*i + 2].data.push(data.last[i]);
+			}
+		} else {
+			chart.data.labels = data.x;
+			for (var i = 0; i < data.series.length; i++) {
+				chart.data.datasets[3*i].data = data.series[i].max;
+				chart.data.datasets[3*i + 1].data = data.series[i].min;
+				chart.data.datasets[3*i + 2].data = data.series[i].mean;
+			}
+		}
+		chart.update();
+	};
+
+	this.reset = function() {
+		chart.data.labels = [];
+		chart.data.datasets.forEach(function(dataset) { dataset.data = []; });
+		chart.update();
+	};
+};
@@ -10,32 +10,26 @@ os.chdir('C:\\Books\\simulation\\MFD_Simulation\\MFD_Simulation\\boid_flockers')
 
 from boid import Boid
 from model import BoidFlockers
-from mesa.batchrunner import BatchRunner
 import matplotlib.pyplot as plt
-import pandas as pd
-from mesa.datacollection import DataCollector
-import time
 import numpy as np
 
 
 #%%
 
 #%%
-
-model = BoidFlockers(rate=200, vision=4, separation=1)
-a = time.time()
-for i in range(500):
-    model.step()
-    try:
-        print(len(model.space._agent_points))
-    except: pass
-    print('step # ', i, ' took ', (time.time()-a)*1000, 'ms')
-    a=time.time()
+if __name__ == '__main__':
+    model = BoidFlockers(rate=200, vision=4, separation=1, profile=True)
+    for i in range(500):
+        model.step()
+    step_times = model.profiler.table()
+    print(model.profiler.report())
     
 #%%
 
 
 #%%
+from boid_flockers.sweep import run_sweep, load_sweep
+
 fixed_params = {"width": 100,
                "height": 100,
                "vision": 4,
@@ -45,39 +39,24 @@ fixed_params = {"width": 100,
 
 variable_params = {"rate": [2,4]}
 
-batch_run = BatchRunner(BoidFlockers,
-                        variable_params,
-                        fixed_params,
-                        iterations=1,
-                        max_steps=200,
-                        model_reporters={"Data Collector": lambda m: \
-                                         m.datacollector},
-                        )
-
-#%%
-
-#%%
-batch_run.run_all()
-#%%
-
+if __name__ == '__main__':
+    run_index = run_sweep(variable_params,
+                          fixed_params,
+                          iterations=1,
+                          max_steps=200,
+                          out_dir='sweep_output',
+                          agent_data=True)
 
 #%%
-run_data = batch_run.get_model_vars_dataframe()
-br_step_data = pd.DataFrame()
-for i in range(len(run_data["Data Collector"])):
-    if isinstance(run_data["Data Collector"][i], DataCollector):
-        i_run_data = run_data["Data Collector"][i].get_agent_vars_dataframe()
-        # i_run_data['time'] = i_run_data.index
-        i_run_data['time'] = [x[0] for x in i_run_data.index]
-        i_run_data['sim'] = str(i)
-        br_step_data = br_step_data.append(i_run_data, ignore_index=True)
-#run_data.head()
-# plt.scatter(run_data.N, run_data.Gini)
+if __name__ == '__main__':
+    br_step_data = load_sweep('sweep_output', kind='agent')
+    model_data = load_sweep('sweep_output')
 #%%
         
 
 
 #%%
-plt.scatter(br_step_data.loc[br_step_data['time']<=1200,'Occupancy'],\
-            br_step_data.loc[br_step_data['time']<=1200,'Speed'])
+if __name__ == '__main__':
+    plt.scatter(model_data.loc[model_data['time']<=1200,'Occupancy'],\
+                model_data.loc[model_data['time']<=1200,'Speed'])
 #%%
\ No newline at end of file
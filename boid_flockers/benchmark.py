@@ -0,0 +1,225 @@
+"""
+Step benchmark
+=============================================================
+Repeatable throughput benchmark for BoidFlockers.
+
+Every case of the rate x vision x separation x size_factor grid runs in a
+fresh process: the model is warmed up until occupancy settles (or a warm-up
+step limit is hit), then a fixed number of steps is timed. Results report
+steps/sec, agent-updates/sec and the peak RSS of the case's process, and
+are written as JSON so later runs can be compared against a saved baseline:
+
+    python -m boid_flockers.benchmark --rate 50 200 --engine vector \\
+        --neighbor-index grid --out bench.json --baseline baseline.json
+"""
+import argparse
+import itertools
+import json
+import platform
+import sys
+import time
+import multiprocessing
+
+import numpy as np
+
+from .model import BoidFlockers
+
+
+def peak_rss_mb():
+    """
+    Peak resident set size of this process in MB (None where unsupported).
+
+    On Linux this is VmHWM, the high-water mark of the current address
+    space, which starts over when a process is spawned; ru_maxrss would
+    carry over the peak of the process that started it.
+    """
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return round(int(line.split()[1])/2**10, 1)
+    except OSError:
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere.
+    peak = peak/2**20 if sys.platform == "darwin" else peak/2**10
+    return round(peak, 1)
+
+
+def warm_up(model, min_steps=100, max_steps=1000, window=50, tol=0.05):
+    """
+    Step the model until the mean occupancy of the last two windows differs
+    by less than tol (relative), after at least min_steps.
+
+    Returns:
+        Number of warm-up steps taken.
+    """
+    occupancy = []
+    for step in range(max_steps):
+        model.step()
+        occupancy.append(model.num_agents)
+        if step + 1 >= max(min_steps, 2*window):
+            previous = np.mean(occupancy[-2*window:-window])
+            current = np.mean(occupancy[-window:])
+            if abs(current - previous) <= tol*max(previous, 1):
+                return step + 1
+    return max_steps
+
+
+def run_case(case):
+    """
+    Warm up and time one benchmark case. Meant to run in its own spawned
+    process, which starts from a fresh interpreter instead of a fork of the
+    caller, so the peak RSS belongs to this case only.
+    """
+    params = dict(case["params"])
+    model = BoidFlockers(seed=case["seed"], **params)
+    warmup_steps = warm_up(model, case["min_warmup"], case["max_warmup"])
+
+    agent_updates = 0
+    start = time.perf_counter()
+    for i in range(case["steps"]):
+        agent_updates += model.num_agents
+        model.step()
+    elapsed = time.perf_counter() - start
+
+    return {"key": case_key(params),
+            "params": params,
+            "warmup_steps": warmup_steps,
+            "steps": case["steps"],
+            "seconds": elapsed,
+            "steps_per_sec": case["steps"]/elapsed,
+            "agent_updates_per_sec": agent_updates/elapsed,
+            "mean_agents": agent_updates/case["steps"],
+            "peak_rss_mb": peak_rss_mb()}
+
+
+grid_params = ("rate", "vision", "separation", "size_factor")
+
+
+def case_key(params):
+    """
+    Key results are matched on when comparing against a baseline. Only the
+    load parameters are used, so a run with another engine or neighbor index
+    can be compared against the same baseline.
+    """
+    return ",".join("{}={}".format(k, params[k]) for k in grid_params)
+
+
+def run_benchmark(
+        rate=(50, 200),
+        vision=(4,),
+        separation=(1,),
+        size_factor=(2,),
+        steps=100,
+        min_warmup=100,
+        max_warmup=1000,
+        seed=0,
+        **fixed_params):
+    """
+    Run every case of the parameter grid, one fresh process per case.
+
+    Args:
+        rate, vision, separation, size_factor: Values to benchmark.
+        steps: Timed steps per case.
+        min_warmup, max_warmup: Bounds on the warm-up steps (see warm_up).
+        seed: Model seed used for every case.
+        fixed_params: Other BoidFlockers arguments, e.g. engine='vector'.
+
+    Returns:
+        Dict with a "meta" block describing the machine and a "results" list.
+    """
+    cases = []
+    for r, v, s, f in itertools.product(rate, vision, separation, size_factor):
+        params = dict(fixed_params, rate=r, vision=v, separation=s,
+                      size_factor=f)
+        cases.append({"params": params, "steps": steps, "seed": seed,
+                      "min_warmup": min_warmup, "max_warmup": max_warmup})
+
+    results = []
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(1, maxtasksperchild=1) as pool:
+        for result in pool.imap(run_case, cases):
+            results.append(result)
+
+    meta = {"python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "processor": platform.processor(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S")}
+    return {"meta": meta, "results": results}
+
+
+def compare(results, baseline, threshold=0.1):
+    """
+    Compare benchmark results against a baseline run case by case.
+
+    Returns:
+        List of dicts with the speed ratio (current/baseline steps per sec)
+        and a regression flag when the ratio drops below 1 - threshold.
+    """
+    base = {r["key"]: r for r in baseline["results"]}
+    rows = []
+    for result in results["results"]:
+        if result["key"] not in base:
+            continue
+        ratio = result["steps_per_sec"]/base[result["key"]]["steps_per_sec"]
+        rows.append({"key": result["key"],
+                     "steps_per_sec": result["steps_per_sec"],
+                     "baseline_steps_per_sec":
+                         base[result["key"]]["steps_per_sec"],
+                     "ratio": ratio,
+                     "regression": ratio < 1 - threshold})
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Benchmark BoidFlockers step throughput.")
+    parser.add_argument("--rate", type=float, nargs="+", default=[50, 200])
+    parser.add_argument("--vision", type=float, nargs="+", default=[4])
+    parser.add_argument("--separation", type=float, nargs="+", default=[1])
+    parser.add_argument("--size-factor", type=float, nargs="+", default=[2])
+    parser.add_argument("--engine", default="agent")
+    parser.add_argument("--neighbor-index", default=None)
+    parser.add_argument("--steps", type=int, default=100)
+    parser.add_argument("--min-warmup", type=int, default=100)
+    parser.add_argument("--max-warmup", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default="benchmark.json")
+    parser.add_argument("--baseline", default=None)
+    parser.add_argument("--threshold", type=float, default=0.1)
+    args = parser.parse_args(argv)
+
+    results = run_benchmark(
+        rate=args.rate, vision=args.vision, separation=args.separation,
+        size_factor=args.size_factor, steps=args.steps,
+        min_warmup=args.min_warmup, max_warmup=args.max_warmup,
+        seed=args.seed, engine=args.engine,
+        neighbor_index=args.neighbor_index)
+    with open(args.out, "w") as f:
+        json.dump(results, f, indent=2)
+
+    for r in results["results"]:
+        print("{key}: {steps_per_sec:.1f} steps/s, "
+              "{agent_updates_per_sec:.0f} agent-updates/s, "
+              "{mean_agents:.0f} agents, "
+              "peak RSS {peak_rss_mb} MB".format(**r))
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            rows = compare(results, json.load(f), args.threshold)
+        for row in rows:
+            print("{key}: {ratio:.2f}x baseline{flag}".format(
+                flag=" REGRESSION" if row["regression"] else "", **row))
+        if any(row["regression"] for row in rows):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -106,7 +106,8 @@ class Boid(Agent):
             x,y = (self.pos-npos)[:,0],(self.pos-npos)[:,1]
             
             dist_intruder = np.sqrt(x**2 + y**2)
-            self.model.n_intrusion += int(sum((dist_intruder <= self.separation/2)*1))
+            self.n_intrusion = int(sum((dist_intruder <= self.separation/2)*1))
+            self.model.n_intrusion += self.n_intrusion
             v_x,v_y = (self.velocity - nvel)[:,0],(self.velocity - nvel)[:,1]
             m = -v_y/(v_x) 
             b = y + x*v_y/(v_x)
@@ -116,7 +117,8 @@ class Boid(Agent):
             dist_closest = np.sqrt(c_x**2 + c_y**2)
             
             sep = (dist_closest <= self.separation)*1
-            self.model.n_confs += int(sum(sep))
+            self.n_conf = int(sum(sep))
+            self.model.n_confs += self.n_conf
             time_closest = (dist_closest)/self.speed
             factor = self.separation/(dist_closest) 
             co = np.array([c_x*factor,
@@ -138,17 +140,30 @@ class Boid(Agent):
         """
         Get the Boid's neighbors, compute the new vector, and move accordingly.
         """
+        acc = self.model.acc
+        before = acc.share(self)
+        old_pos = self.pos
         try:
             self.n_conf = 0
             self.n_intrusion = 0
             self.current_time = self.model.schedule.time
             self.previos_distance = self.distance()
+            profiler = self.model.profiler
+            start = profiler.clock()
             
-            neighbors = self.model.space.get_neighbors(self.pos, self.vision, False)
+            if self.model.neighbor_index is None:
+                neighbors = self.model.space.get_neighbors(self.pos, self.vision, False)
+            else:
+                neighbors = self.model.indexed_neighbors(self)
+            queried = profiler.clock()
+            profiler.add('neighbors', queried - start)
+            profiler.count('neighbor_pairs', len(neighbors))
 
             self.velocity =  self.direct()/np.linalg.norm(self.direct())*self.speed
             
             self.velocity += self.mvp(neighbors)
+            resolved = profiler.clock()
+            profiler.add('mvp', resolved - queried)
             # for neighbor in neighbors:
                 # self.velocity += 0#self.mvp(neighbor)
             
@@ -165,11 +180,9 @@ class Boid(Agent):
             
             self.current_distance = self.distance()
             self.effective_speed = self.previos_distance - self.current_distance
-            
-            self.freeflow_endtime = self.entry_time + self.od_dist/self.speed
-            self.enroute_del = max(self.current_time - self.freeflow_endtime, 0)
-            
 
             if self.distance() <= self.speed:
                 self.model.kill_agents.append(self)
-        except: print(self.unique_id, 'something went wrong!')
\ No newline at end of file
+            profiler.add('move', profiler.clock() - resolved)
+        except: print(self.unique_id, 'something went wrong!')
+        acc.moved(self, before, old_pos)
\ No newline at end of file
@@ -0,0 +1,168 @@
+"""
+Command line
+=============================================================
+Headless runner for single scenarios and sweeps from a config file.
+
+    python -m boid_flockers scenario.toml --workers 8 --out results/
+
+A config has up to four tables (TOML, or YAML if PyYAML is installed):
+
+    [model]          # BoidFlockers arguments shared by every run
+    vision = 4
+    separation = 1
+    engine = "vector"
+    neighbor_index = "grid"
+    monitor = true
+
+    [run]            # how to run it; command line options win
+    max_steps = 1200
+    iterations = 1
+    seed = 0
+    workers = 4
+    out = "results"
+    format = "parquet"   # or "csv", or "npy" for memory-mapped results
+    agent_data = false
+
+    [sweep]          # optional: value lists, one run per combination
+    rate = [50, 100, 200, 400]
+
+    [adaptive]       # optional instead of [sweep], see adaptive.py
+    rates = [10, 100, 300, 600]
+    max_runs = 60
+
+Without [sweep] or [adaptive] the [model] scenario runs `iterations` times.
+Every run writes its model time series to <out>/model_<id>.<format> and
+<out>/index.csv lists all runs with their parameters.
+"""
+import argparse
+import json
+import os
+import sys
+
+try:
+    import tomllib
+except ImportError:     # Python < 3.11
+    import tomli as tomllib
+
+from .sweep import run_sweep
+from .adaptive import run_adaptive_sweep
+
+run_defaults = {"max_steps": 1200,
+                "iterations": 1,
+                "seed": 0,
+                "workers": None,
+                "out": "results",
+                "format": "parquet",
+                "agent_data": False}
+
+
+def load_config(path):
+    """
+    Read a TOML or YAML config file into a dict.
+    """
+    if path.endswith((".yaml", ".yml")):
+        try:
+            import yaml
+        except ImportError:
+            raise ImportError("YAML configs require PyYAML")
+        with open(path) as f:
+            return yaml.safe_load(f) or {}
+    with open(path, "rb") as f:
+        return tomllib.load(f)
+
+
+def parse_value(text):
+    """
+    Parse a --set value as a TOML value, falling back to a plain string.
+    """
+    try:
+        return tomllib.loads("value = " + text)["value"]
+    except tomllib.TOMLDecodeError:
+        return text
+
+
+def run_config(config):
+    """
+    Run the scenario or sweep described by a config dict.
+
+    Returns:
+        The run index DataFrame.
+    """
+    unknown = set(config) - {"model", "run", "sweep", "adaptive"}
+    if unknown:
+        raise ValueError("Unknown config tables: {}".format(sorted(unknown)))
+    if "sweep" in config and "adaptive" in config:
+        raise ValueError("Use either [sweep] or [adaptive], not both")
+    model = dict(config.get("model", {}))
+    run = dict(run_defaults, **config.get("run", {}))
+    unknown = set(run) - set(run_defaults)
+    if unknown:
+        raise ValueError("Unknown [run] keys: {}".format(sorted(unknown)))
+
+    if run["format"] == "parquet":
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            raise ImportError("format = \"parquet\" requires pyarrow; "
+                              "install it or use --format csv")
+
+    os.makedirs(run["out"], exist_ok=True)
+    with open(os.path.join(run["out"], "config.json"), "w") as f:
+        json.dump(config, f, indent=2)
+
+    if "adaptive" in config:
+        adaptive = dict(config["adaptive"])
+        rates = adaptive.pop("rates")
+        index, points = run_adaptive_sweep(
+            rates, model, iterations=run["iterations"],
+            max_steps=run["max_steps"], out_dir=run["out"],
+            workers=run["workers"], seed=run["seed"],
+            agent_data=run["agent_data"], fmt=run["format"], **adaptive)
+        return index
+
+    variable = {name: values if isinstance(values, list) else [values]
+                for name, values in config.get("sweep", {}).items()}
+    return run_sweep(variable, model, iterations=run["iterations"],
+                     max_steps=run["max_steps"], out_dir=run["out"],
+                     workers=run["workers"], seed=run["seed"],
+                     agent_data=run["agent_data"], fmt=run["format"])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m boid_flockers",
+        description="Run BoidFlockers scenarios and sweeps headless.")
+    parser.add_argument("config", help="TOML or YAML config file")
+    parser.add_argument("--workers", type=int)
+    parser.add_argument("--engine", choices=("agent", "vector"))
+    parser.add_argument("--out", help="output directory")
+    parser.add_argument("--format", choices=("parquet", "csv", "npy"))
+    parser.add_argument("--max-steps", type=int)
+    parser.add_argument("--iterations", type=int)
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--set", action="append", default=[],
+                        metavar="NAME=VALUE",
+                        help="override a [model] argument, e.g. rate=200")
+    args = parser.parse_args(argv)
+
+    config = load_config(args.config)
+    config.setdefault("model", {})
+    config.setdefault("run", {})
+    for item in args.set:
+        name, _, value = item.partition("=")
+        config["model"][name.strip()] = parse_value(value.strip())
+    if args.engine:
+        config["model"]["engine"] = args.engine
+    for name in ("workers", "out", "format", "max_steps", "iterations",
+                 "seed"):
+        if getattr(args, name) is not None:
+            config["run"][name] = getattr(args, name)
+
+    index = run_config(config)
+    print("{} runs written to {}".format(len(index), config["run"].get(
+        "out", run_defaults["out"])))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
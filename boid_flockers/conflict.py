@@ -0,0 +1,119 @@
+"""
+Pairwise conflicts
+=============================================================
+Conflict detection and resolution over unordered pairs of boids.
+
+Every pair within vision is evaluated once per step. The closest point of
+approach (CPA) of the two straight-line trajectories is computed from the
+relative position d and relative velocity v:
+
+    t_cpa = max(-(d . v) / |v|^2, 0)        (0 when |v| is ~0)
+    d_cpa = |d + v t_cpa|
+
+so there is no division by a velocity component and diverging pairs get
+their CPA now. A pair is in conflict when d_cpa < separation within the
+lookahead time, and an intrusion when the current distance is within
+separation/2. Conflicts are resolved with the Modified Voltage Potential:
+the velocity change that moves the CPA out to the separation distance is
+split evenly between both aircraft, in opposite directions.
+"""
+import numpy as np
+
+from .spatial import pairs_within
+
+
+def unique_pairs(pos, radius, index=None):
+    """
+    Unordered pairs (i, j), i < j, with 0 < |pos[i] - pos[j]| <= radius.
+
+    Args:
+        index: Optional GridIndex/KDTreeIndex, rebuilt from pos.
+    """
+    if index is None:
+        i, j = pairs_within(pos, radius)
+        once = i < j
+        return i[once], j[once]
+    return index.build(pos).pairs(radius)
+
+
+def closest_approach(pos, vel, i, j):
+    """
+    CPA geometry of the pairs (i, j).
+
+    Returns:
+        (t_cpa, d_cpa, cpa_vector, distance) where cpa_vector is
+        pos[i] - pos[j] at the CPA and distance is the current distance.
+    """
+    d = pos[i] - pos[j]
+    v = vel[i] - vel[j]
+    vv = (v**2).sum(axis=1)
+    dv = (d*v).sum(axis=1)
+    moving = vv > 1e-12
+    t_cpa = np.zeros(len(d))
+    t_cpa[moving] = np.maximum(-dv[moving]/vv[moving], 0)
+    cpa_vector = d + v*t_cpa[:, None]
+    d_cpa = np.sqrt((cpa_vector**2).sum(axis=1))
+    distance = np.sqrt((d**2).sum(axis=1))
+    return t_cpa, d_cpa, cpa_vector, distance
+
+
+def resolve_pairs(pos, vel, i, j, separation, lookahead=np.inf, min_time=1,
+                  counts=None):
+    """
+    Detect conflicts between the pairs (i, j) and compute symmetric MVP
+    resolutions.
+
+    Args:
+        pos, vel: (N,2) positions and intended velocities.
+        i, j: Index arrays of unordered pairs, each pair listed once.
+        separation: Minimum separation.
+        lookahead: Only conflicts with t_cpa <= lookahead are counted and
+                resolved.
+        min_time: Lower bound on the time over which the CPA is moved, so
+                imminent conflicts do not get unbounded velocity changes.
+        counts: Optional (N,2) array; every conflict and intrusion adds
+                1/2 to the rows of both aircraft.
+
+    Returns:
+        (delta_velocity, n_confs, n_intrusion) with delta_velocity (N,2).
+    """
+    delta = np.zeros((len(pos), 2))
+    if len(i) == 0:
+        return delta, 0, 0
+
+    t_cpa, d_cpa, cpa_vector, distance = closest_approach(pos, vel, i, j)
+    intrusion = distance <= separation/2
+    n_intrusion = int(np.count_nonzero(intrusion))
+    conflict = (d_cpa < separation) & (t_cpa <= lookahead)
+    n_confs = int(np.count_nonzero(conflict))
+    if counts is not None:
+        for column, hit in enumerate((conflict, intrusion)):
+            for rows in (i[hit], j[hit]):
+                counts[:, column] += np.bincount(rows, minlength=len(pos))/2
+    if not n_confs:
+        return delta, 0, n_intrusion
+
+    i, j = i[conflict], j[conflict]
+    t_cpa, d_cpa, cpa_vector = t_cpa[conflict], d_cpa[conflict], cpa_vector[conflict]
+
+    # Direction to push the CPA apart. For a head-on geometry (CPA at zero
+    # distance) use the normal of the relative velocity, and the current
+    # offset when the relative velocity vanishes as well.
+    direction = cpa_vector.copy()
+    head_on = d_cpa < 1e-9
+    if head_on.any():
+        v = vel[i[head_on]] - vel[j[head_on]]
+        normal = np.stack([-v[:, 1], v[:, 0]], axis=1)
+        still = (normal**2).sum(axis=1) < 1e-24
+        normal[still] = pos[i[head_on]][still] - pos[j[head_on]][still]
+        normal[(normal**2).sum(axis=1) < 1e-24] = (1.0, 0.0)
+        direction[head_on] = normal
+    direction /= np.sqrt((direction**2).sum(axis=1))[:, None]
+
+    change = direction*((separation - d_cpa)/np.maximum(t_cpa, min_time))[:, None]
+    for axis in (0, 1):
+        delta[:, axis] += np.bincount(i, weights=change[:, axis]/2,
+                                      minlength=len(pos))
+        delta[:, axis] -= np.bincount(j, weights=change[:, axis]/2,
+                                      minlength=len(pos))
+    return delta, n_confs, n_intrusion
@@ -0,0 +1,352 @@
+"""
+Domain decomposition
+=============================================================
+Multi-process runs of a single large airspace.
+
+DecomposedRun splits the ContinuousSpace into tx by ty tiles and hands them
+round-robin to worker processes. The boid arrays live in shared memory
+(multiprocessing.shared_memory), so nothing is copied between processes:
+
+    1. The coordinator draws arrivals and admits departures, as Ensemble
+       does, then sorts the placed boids by the tile they are in and
+       publishes that order.
+    2. Every worker steps the boids of its tiles: it reads them together
+       with their halo, the boids of the neighboring tiles within vision of
+       the tile, from the start-of-step arrays and writes the new state of
+       its own boids to separate output arrays.
+    3. The coordinator commits the outputs, removes the arrived boids and
+       computes the reporters of the whole airspace.
+
+Because the vector step is synchronous, a boid's update only depends on
+start-of-step positions within vision, which is all a tile plus its halo
+holds. A boid that crosses a tile boundary is simply found in its new tile
+by the next step's sort, which is the handoff. Tiles must be at least
+vision wide so the halo lies within the eight neighboring tiles.
+
+    with DecomposedRun((4, 4), workers=8, width=2000, height=2000,
+                       rate=6000, vision=4, separation=1) as run:
+        run.run(1200)
+        model_vars = run.model_vars(0)
+
+A run that is dropped without close() stops its workers and unlinks its
+shared memory when it is garbage collected, or at interpreter exit.
+
+The reporters are those of Ensemble with a single replication. With
+conflict='pairwise' a pair across a tile boundary is resolved by both
+owners, each applying its own half, and counted half in each tile. Results
+agree with BoidFlockers(engine='vector') up to the summation order of
+neighbor contributions, i.e. statistically (see ensemble.py).
+"""
+import traceback
+import weakref
+from multiprocessing import Pipe, Process
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+
+from .conflict import resolve_pairs
+from .engine import desired_velocity, move_boids, mvp_pairs, store_move
+from .ensemble import Ensemble
+from .spatial import csr_pairs, make_index
+
+# Arrays the workers write; one row per boid row, like the state arrays.
+_outputs = (('out_velocity', 2, float), ('out_pos', 2, float),
+            ('out_physic_speed', 1, float), ('out_prev_dist', 1, float),
+            ('out_cur_dist', 1, float), ('out_moved', 1, bool),
+            ('out_arrived', 1, bool), ('out_counts', 2, float),
+            ('out_travelled', 1, float))
+
+
+def _attach(spec):
+    """
+    Map the shared arrays described by spec ({name: (block, shape, dtype)}).
+    """
+    blocks, arrays = [], {}
+    for name, (block, shape, dtype) in spec.items():
+        shm = SharedMemory(block)
+        blocks.append(shm)
+        arrays[name] = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+    return blocks, arrays
+
+
+def step_tile(arrays, params, tile, ptr, index=None):
+    """
+    Step the boids of one tile and write their new state to the out_
+    arrays.
+
+    Args:
+        arrays: Shared arrays by name.
+        params: Geometry and model parameters (see DecomposedRun._params).
+        tile: Tile number, ix*ty + iy.
+        ptr: Tile offsets into arrays["order"].
+        index: Neighbor index to reuse.
+    """
+    order = arrays["order"]
+    own = order[ptr[tile]:ptr[tile + 1]]
+    if len(own) == 0:
+        return
+    tx, ty = params["tiles"]
+    ix, iy = divmod(tile, ty)
+    vision = params["vision"]
+    separation = params["separation"]
+    pos_all = arrays["kinematics"][:, 0:2]
+
+    # Halo: boids of the neighboring tiles within vision of this one.
+    neighbors = [(ix + dx)*ty + iy + dy
+                 for dx in (-1, 0, 1) for dy in (-1, 0, 1)
+                 if (dx or dy) and 0 <= ix + dx < tx and 0 <= iy + dy < ty]
+    halo = np.concatenate([order[ptr[k]:ptr[k + 1]] for k in neighbors] +
+                          [np.zeros(0, dtype=np.intp)])
+    x0, x1 = params["x_edges"][ix], params["x_edges"][ix + 1]
+    y0, y1 = params["y_edges"][iy], params["y_edges"][iy + 1]
+    hp = pos_all[halo]
+    halo = halo[(hp[:, 0] >= x0 - vision) & (hp[:, 0] <= x1 + vision) &
+                (hp[:, 1] >= y0 - vision) & (hp[:, 1] <= y1 + vision)]
+
+    rows = np.concatenate([own, halo])
+    n_own = len(own)
+    pos = pos_all[rows]
+    dest = arrays["kinematics"][rows, 4:6]
+    speed = arrays["speed"][rows]
+    desired, prev_dist = desired_velocity(pos, dest, speed)
+
+    counts = np.zeros((len(rows), 2))
+    if params["conflict"] == 'pairwise':
+        if index is None:
+            i, j = _brute_pairs(pos, vision)
+        else:
+            i, j = index.build(pos).pairs(vision)
+        # Pairs inside the halo belong to other tiles.
+        mine = (i < n_own) | (j < n_own)
+        delta, _, _ = resolve_pairs(pos, desired, i[mine], j[mine],
+                                    separation, counts=counts)
+    else:
+        if index is None:
+            own_k, intruder = _brute_pairs(pos, vision, n_own)
+        else:
+            index.build(pos)
+            own_k, intruder = csr_pairs(*index.query(pos[:n_own], vision))
+        delta, _, _ = mvp_pairs(pos, desired, arrays["kinematics"][rows, 2:4],
+                                speed, separation, own_k, intruder, counts)
+
+    (velocity, physic_speed, new_pos, moved, cur_dist, travelled,
+     arrived) = move_boids(pos[:n_own], dest[:n_own], speed[:n_own],
+                           desired[:n_own], delta[:n_own], params["bounds"])
+    arrays["out_velocity"][own] = velocity
+    arrays["out_pos"][own] = new_pos
+    arrays["out_physic_speed"][own] = physic_speed
+    arrays["out_prev_dist"][own] = prev_dist[:n_own]
+    arrays["out_cur_dist"][own] = cur_dist
+    arrays["out_moved"][own] = moved
+    arrays["out_arrived"][own] = arrived
+    arrays["out_counts"][own] = counts[:n_own]
+    arrays["out_travelled"][own] = travelled
+
+def _brute_pairs(pos, radius, n_queries=None):
+    """
+    Pairs within radius without an index: ordered (query, neighbor) pairs
+    of the first n_queries points, or unordered i < j pairs of all points.
+    """
+    queries = pos if n_queries is None else pos[:n_queries]
+    d = queries[:, None, :] - pos[None, :, :]
+    d2 = (d**2).sum(axis=2)
+    i, j = np.nonzero((d2 <= radius**2) & (d2 > 0))
+    if n_queries is None:
+        once = i < j
+        return i[once], j[once]
+    return i, j
+
+
+def _release(conns, procs, blocks):
+    """
+    Stop the workers and unlink the shared memory blocks of a run. The
+    containers are emptied, so a second call does nothing.
+    """
+    for conn in conns:
+        try:
+            conn.send(("stop",))
+        except (BrokenPipeError, OSError):
+            pass
+    for proc in procs:
+        proc.join()
+    for shm, _, _ in blocks.values():
+        shm.unlink()
+        try:
+            shm.close()
+        except BufferError:
+            # Views into the block are still alive (the run was garbage
+            # collected); the mapping goes with them.
+            pass
+    del conns[:], procs[:]
+    blocks.clear()
+
+
+def _worker(conn, tiles, params):
+    """
+    Worker process: step the given tiles whenever the coordinator asks.
+    """
+    blocks, arrays = [], {}
+    index = make_index(params["neighbor_index"], params["vision"],
+                       params["separation"])
+    try:
+        while True:
+            message = conn.recv()
+            if message[0] == "stop":
+                break
+            _, ptr, spec = message
+            try:
+                if spec is not None:
+                    arrays = {}
+                    for shm in blocks:
+                        shm.close()
+                    blocks, arrays = _attach(spec)
+                for tile in tiles:
+                    step_tile(arrays, params, tile, ptr, index)
+                conn.send(None)
+            except Exception:
+                conn.send(traceback.format_exc())
+    finally:
+        arrays = {}
+        for shm in blocks:
+            shm.close()
+
+
+class DecomposedRun(Ensemble):
+    """
+    One BoidFlockers scenario stepped by tile worker processes.
+
+    Args:
+        tiles: (tx, ty) number of tiles along x and y.
+        workers: Number of worker processes (default: one per tile).
+        seed: Seed of the run, as for BoidFlockers(seed=...).
+        Other arguments as for Ensemble, without replications.
+    """
+
+    def __init__(self, tiles=(2, 2), workers=None, seed=None, **params):
+        self._blocks = {}
+        self._spec_changed = True
+        self._conns = []
+        self._procs = []
+        # Releases the workers and the shared memory if close() is never
+        # called; it must not hold a reference to the run itself.
+        self._finalizer = weakref.finalize(self, _release, self._conns,
+                                           self._procs, self._blocks)
+        super().__init__(seeds=[seed], **params)
+
+        tx, ty = tiles
+        width, height = self.space.x_max, self.space.y_max
+        if width/tx < self.vision or height/ty < self.vision:
+            raise ValueError("Tiles must be at least vision wide")
+        self.tiles = (tx, ty)
+        self._params = {"tiles": (tx, ty),
+                        "x_edges": np.linspace(0, width, tx + 1),
+                        "y_edges": np.linspace(0, height, ty + 1),
+                        "bounds": (self.space.x_min, self.space.x_max,
+                                   self.space.y_min, self.space.y_max),
+                        "vision": self.vision,
+                        "separation": self.separation,
+                        "conflict": self.conflict,
+                        "neighbor_index": params.get("neighbor_index",
+                                                     'grid')}
+        workers = min(workers or tx*ty, tx*ty)
+        for w in range(workers):
+            parent, child = Pipe()
+            proc = Process(target=_worker, daemon=True,
+                           args=(child, list(range(w, tx*ty, workers)),
+                                 self._params))
+            proc.start()
+            self._conns.append(parent)
+            self._procs.append(proc)
+
+    def _grow(self, capacity):
+        """
+        Allocate the state and output arrays in shared memory.
+        """
+        old = dict(self._blocks)
+        shapes = [(name, getattr(self, name).shape[1:],
+                   getattr(self, name).dtype) for name in self._fields]
+        shapes += [(name, (width,) if width > 1 else (), np.dtype(dtype))
+                   for name, width, dtype in _outputs]
+        shapes.append(("order", (), np.dtype(np.intp)))
+
+        self._blocks.clear()
+        for name, tail, dtype in shapes:
+            shape = (capacity,) + tail
+            shm = SharedMemory(create=True,
+                               size=max(int(np.prod(shape))*dtype.itemsize, 1))
+            array = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+            array[:] = 0
+            current = getattr(self, name, None)
+            if current is not None and name in self._fields:
+                array[:len(current)] = current
+            setattr(self, name, array)
+            self._blocks[name] = (shm, shape, dtype)
+        current = array = None
+        self.pos = self.kinematics[:, 0:2]
+        self.velocity = self.kinematics[:, 2:4]
+        self.destination = self.kinematics[:, 4:6]
+        self.capacity = capacity
+        self._spec_changed = True
+        for shm, _, _ in old.values():
+            shm.close()
+            shm.unlink()
+
+    def _spec(self):
+        return {name: (shm.name, shape, dtype)
+                for name, (shm, shape, dtype) in self._blocks.items()}
+
+    def tile_of(self, pos):
+        """
+        Tile number ix*ty + iy of every position.
+        """
+        tx, ty = self.tiles
+        ix = np.minimum((pos[:, 0]*tx/self.space.x_max).astype(np.intp),
+                        tx - 1)
+        iy = np.minimum((pos[:, 1]*ty/self.space.y_max).astype(np.intp),
+                        ty - 1)
+        return ix*ty + iy
+
+    def _move(self):
+        rows = self.active()
+        if len(rows) == 0:
+            return rows, np.zeros(1), np.zeros(1)
+        tile = self.tile_of(self.pos[rows])
+        sort = np.argsort(tile, kind='stable')
+        self.order[:len(rows)] = rows[sort]
+        ptr = np.zeros(self.tiles[0]*self.tiles[1] + 1, dtype=np.intp)
+        np.cumsum(np.bincount(tile, minlength=len(ptr) - 1), out=ptr[1:])
+
+        spec = self._spec() if self._spec_changed else None
+        self._spec_changed = False
+        for conn in self._conns:
+            conn.send(("step", ptr, spec))
+        errors = [error for error in (conn.recv() for conn in self._conns)
+                  if error is not None]
+        if errors:
+            raise RuntimeError("Tile worker failed:\n" + errors[0])
+
+        moved = self.out_moved[rows]
+        store_move(self, rows, self.out_prev_dist[rows],
+                   self.out_velocity[rows], self.out_physic_speed[rows],
+                   self.out_pos[rows], moved, self.out_cur_dist[rows])
+        self.vkt += self._per_rep(rows[moved], self.out_travelled[rows][moved])
+        counts = self.out_counts[rows]
+        arrived = rows[self.out_arrived[rows]]
+        return (arrived, self._per_rep(rows, counts[:, 0]),
+                self._per_rep(rows, counts[:, 1]))
+
+    def close(self):
+        """
+        Stop the workers and release the shared memory.
+        """
+        # Drop our views before closing the mappings.
+        for name in self._blocks:
+            setattr(self, name, None)
+        self.pos = self.velocity = self.destination = None
+        self._finalizer()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,96 @@
+"""
+Departure queue
+=============================================================
+FIFO queue of boids waiting for a conflict-free origin.
+
+All waiting origins are tested against the current occupancy in one batched
+spatial query per step. Origins that are clear are then admitted in FIFO
+order, skipping any that would conflict with an agent admitted earlier in
+the same step. Admitted agents are dropped from the queue in one pass.
+"""
+import numpy as np
+
+from .spatial import GridIndex, csr_pairs
+
+
+class DepartureQueue:
+    """
+    Waiting agents in arrival order, with their origins kept in an array.
+    """
+
+    def __init__(self):
+        self.agents = []
+        self.origins = np.zeros((0, 2))
+        self._new = []
+
+    def __len__(self):
+        return len(self.agents)
+
+    def __iter__(self):
+        return iter(self.agents)
+
+    def __getitem__(self, index):
+        return self.agents[index]
+
+    def append(self, agent):
+        self.agents.append(agent)
+        self._new.append(agent.pos)
+
+    def _origins(self):
+        if self._new:
+            self.origins = np.concatenate(
+                [self.origins, np.reshape(self._new, (-1, 2))])
+            self._new = []
+        return self.origins
+
+    def admit(self, occupied, separation):
+        """
+        Remove and return the agents that can depart now.
+
+        Args:
+            occupied: (N,2) positions of the agents already in the airspace.
+            separation: Minimum distance a departing agent needs from every
+                    other agent, including the ones departing with it.
+
+        Returns:
+            The admitted agents in FIFO order.
+        """
+        origins = self._origins()
+        if len(origins) == 0:
+            return []
+        admitted = admissible(origins, occupied, separation)
+        keep = np.ones(len(origins), dtype=bool)
+        keep[admitted] = False
+        departing = [self.agents[k] for k in admitted]
+        self.agents = [agent for agent, stay in zip(self.agents, keep) if stay]
+        self.origins = origins[keep]
+        return departing
+
+
+def admissible(origins, occupied, separation):
+    """
+    Indices of the origins, in FIFO (array) order, that can depart now: at
+    least separation away from every occupied position and from every origin
+    admitted before them.
+    """
+    if len(origins) == 0:
+        return np.zeros(0, dtype=np.intp)
+    cell_size = separation or 1
+
+    indptr, _ = GridIndex(cell_size).build(occupied).query(
+        origins, separation, include_center=True)
+    candidates = np.flatnonzero(np.diff(indptr) == 0)
+
+    admitted = np.ones(len(candidates), dtype=bool)
+    if len(candidates) > 1:
+        cand_origins = origins[candidates]
+        later, earlier = csr_pairs(*GridIndex(cell_size).build(
+            cand_origins).query(cand_origins, separation,
+                                include_center=True))
+        conflict = earlier < later
+        # Pairs come sorted by the later agent, so every earlier agent's
+        # admission is settled before it can block a later one.
+        for k, j in zip(later[conflict], earlier[conflict]):
+            if admitted[j]:
+                admitted[k] = False
+    return candidates[admitted]
@@ -0,0 +1,101 @@
+"""
+Downsampled series
+=============================================================
+Bounded, multi-resolution aggregates of the model reporter columns.
+
+MultiResolutionSeries keeps at most max_points buckets per column with the
+min, max, sum and count of the values that fell in each. Buckets start one
+step wide; whenever they are all used, neighboring pairs are merged and the
+bucket width doubles (a pyramid over the whole run). A push is O(columns)
+and the occasional merge O(max_points), so keeping and serving the series
+costs the same after a million steps as after a hundred.
+
+BoidFlockers(chart_points=200) keeps one in model.charts, fed with every
+collected model row; AggregatedChartModule draws from it.
+"""
+import numpy as np
+
+
+class MultiResolutionSeries:
+    """
+    Pyramid-downsampled min/mean/max of a set of columns.
+
+    Args:
+        columns: Column names, in the order values are pushed.
+        max_points: Largest number of buckets kept (made even).
+    """
+
+    def __init__(self, columns, max_points=200):
+        self.columns = list(columns)
+        self.max_points = max(2, max_points + max_points % 2)
+        shape = (self.max_points, len(self.columns))
+        self.start = np.zeros(self.max_points, dtype=np.int64)
+        self.steps = np.zeros(self.max_points, dtype=np.int64)
+        self.lo = np.full(shape, np.inf)
+        self.hi = np.full(shape, -np.inf)
+        self.total = np.zeros(shape)
+        self.count = np.zeros(shape, dtype=np.int64)
+        self.width = 1
+        self.n = 0
+
+    def push(self, step, values):
+        """
+        Add one row of values (None or NaN count as missing) for step.
+        """
+        values = np.array([np.nan if v is None else v for v in values],
+                          dtype=float)
+        if self.n == 0 or self.steps[self.n - 1] >= self.width:
+            if self.n == self.max_points:
+                self._merge()
+            k = self.n
+            self.start[k] = step
+            self.steps[k] = 0
+            self.lo[k], self.hi[k] = np.inf, -np.inf
+            self.total[k], self.count[k] = 0, 0
+            self.n += 1
+        k = self.n - 1
+        seen = ~np.isnan(values)
+        self.steps[k] += 1
+        self.lo[k, seen] = np.minimum(self.lo[k, seen], values[seen])
+        self.hi[k, seen] = np.maximum(self.hi[k, seen], values[seen])
+        self.total[k, seen] += values[seen]
+        self.count[k, seen] += 1
+
+    def _merge(self):
+        """
+        Merge neighboring bucket pairs and double the bucket width.
+        """
+        half = self.n//2
+        a, b = slice(0, 2*half, 2), slice(1, 2*half, 2)
+        self.start[:half] = self.start[a]
+        self.steps[:half] = self.steps[a] + self.steps[b]
+        self.lo[:half] = np.minimum(self.lo[a], self.lo[b])
+        self.hi[:half] = np.maximum(self.hi[a], self.hi[b])
+        self.total[:half] = self.total[a] + self.total[b]
+        self.count[:half] = self.count[a] + self.count[b]
+        self.n = half
+        self.width *= 2
+
+    def get(self, name):
+        """
+        (start, min, mean, max) arrays of one column; buckets without a
+        value give NaN.
+        """
+        c = self.columns.index(name)
+        n = self.n
+        count = self.count[:n, c]
+        empty = count == 0
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = self.total[:n, c]/count
+        lo, hi = self.lo[:n, c].copy(), self.hi[:n, c].copy()
+        lo[empty] = hi[empty] = mean[empty] = np.nan
+        return self.start[:n].copy(), lo, mean, hi
+
+
+def chart_rows(model, columns):
+    """
+    The latest collected value of every column.
+    """
+    model_vars = model.datacollector.model_vars
+    return [model_vars[name][-1] if model_vars.get(name) else None
+            for name in columns]
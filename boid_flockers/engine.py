@@ -0,0 +1,393 @@
+"""
+Vector engine
+=============================================================
+Whole-population step engine for the Flockers model.
+
+Instead of calling Boid.step once per agent, the engine keeps every boid's
+state in contiguous numpy arrays and computes heading, MVP conflict
+resolution, move, arrival detection and enroute delay for all agents in one
+batched pass per step. Free-flow end time and enroute delay are set once on
+entry and exit by the model's Accumulators. The heading and move kernels
+(desired_velocity, move_boids, store_move) are shared with Ensemble and the
+tile workers of DecomposedRun.
+
+Agents are updated synchronously: every ownship sees its neighbors at their
+start-of-step positions and velocities, while RandomActivation lets agents
+that already moved this step influence the ones that move later.
+"""
+import numpy as np
+
+from .spatial import csr_pairs, pairs_within
+from .conflict import unique_pairs, resolve_pairs
+
+
+def mvp_pairs(pos, own_vel, nbr_vel, speed, separation, own, intruder,
+              counts=None):
+    """
+    Batched version of Boid.mvp.
+
+    Args:
+        pos: (N,2) positions.
+        own_vel: (N,2) velocities of the ownships (desired heading this step).
+        nbr_vel: (N,2) velocities the intruders are flying with.
+        speed: (N,) ownship speeds.
+        separation: Minimum separation.
+        own, intruder: Index arrays of the pairs to evaluate.
+        counts: Optional (N,2) array; each ownship's conflicts and
+                intrusions are added to its row.
+
+    Returns:
+        (delta_velocity, n_confs, n_intrusion), where delta_velocity is the
+        (N,2) resolution summed over each ownship's neighbors. Pairs whose
+        geometry is degenerate (zero relative x-velocity, zero closest
+        distance) contribute nothing instead of turning the sum into NaN.
+    """
+    n = len(pos)
+    delta = np.zeros((n, 2))
+    if len(own) == 0:
+        return delta, 0, 0
+
+    x, y = (pos[own] - pos[intruder]).T
+    dist_intruder = np.sqrt(x**2 + y**2)
+    intrusion = dist_intruder <= separation/2
+    n_intrusion = int(np.count_nonzero(intrusion))
+
+    v_x, v_y = (own_vel[own] - nbr_vel[intruder]).T
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        m = -v_y/v_x
+        b = y + x*v_y/v_x
+        c_x = -m*b/(m**2 + 1)
+        c_y = b/(m**2 + 1)
+        dist_closest = np.sqrt(c_x**2 + c_y**2)
+        conflict = dist_closest <= separation
+        n_confs = int(np.count_nonzero(conflict))
+
+        time_closest = dist_closest/speed[own]
+        factor = separation/dist_closest
+        d_x = c_x*factor/time_closest
+        d_y = c_y*factor/time_closest
+
+    if counts is not None:
+        counts[:, 0] += np.bincount(own[conflict], minlength=n)
+        counts[:, 1] += np.bincount(own[intrusion], minlength=n)
+
+    valid = np.isfinite(d_x) & np.isfinite(d_y)
+    delta[:, 0] = np.bincount(own[valid], weights=d_x[valid], minlength=n)
+    delta[:, 1] = np.bincount(own[valid], weights=d_y[valid], minlength=n)
+    return delta, n_confs, n_intrusion
+
+
+def desired_velocity(pos, dest, speed):
+    """
+    Velocity straight toward the destination at full speed.
+
+    Returns:
+        (desired, distance): the (N,2) velocities and the (N,) distances to
+        the destinations.
+    """
+    heading = dest - pos
+    distance = np.sqrt((heading**2).sum(axis=1))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        desired = heading/distance[:, None]*speed[:, None]
+    return desired, distance
+
+
+def move_boids(pos, dest, speed, desired, delta, bounds):
+    """
+    Batched move of Boid.step: apply the resolution, normalize and move.
+
+    Boid.step gives up on a move that leaves the non-toroidal space: the
+    agent keeps its position and its last distance and effective speed.
+
+    Args:
+        pos, dest: (N,2) start-of-step positions and destinations.
+        speed: (N,) speeds.
+        desired: (N,2) desired velocities (see desired_velocity).
+        delta: (N,2) conflict resolution added to them.
+        bounds: (x_min, x_max, y_min, y_max) of the space.
+
+    Returns:
+        (velocity, physic_speed, new_pos, moved, cur_dist, travelled,
+        arrived), one row per boid; new_pos is pos, and travelled 0, for
+        the boids that did not move, and arrived is True for the ones that
+        moved to within one step of their destination.
+    """
+    velocity = desired + delta
+    with np.errstate(divide='ignore', invalid='ignore'):
+        velocity /= np.sqrt((velocity**2).sum(axis=1))[:, None]
+    new_pos = pos + velocity*speed[:, None]
+    physic_speed = np.sqrt((velocity**2).sum(axis=1))*speed
+
+    x_min, x_max, y_min, y_max = bounds
+    moved = ((new_pos[:, 0] >= x_min) & (new_pos[:, 0] < x_max) &
+             (new_pos[:, 1] >= y_min) & (new_pos[:, 1] < y_max))
+    new_pos[~moved] = pos[~moved]
+    cur_dist = np.sqrt(((dest - new_pos)**2).sum(axis=1))
+    travelled = np.sqrt(((new_pos - pos)**2).sum(axis=1))
+    arrived = moved & (cur_dist <= speed)
+    return velocity, physic_speed, new_pos, moved, cur_dist, travelled, arrived
+
+
+def store_move(state, rows, prev_dist, velocity, physic_speed, new_pos,
+               moved, cur_dist):
+    """
+    Write the result of move_boids for rows into the arrays of state (a
+    VectorEngine or an Ensemble).
+    """
+    state.velocity[rows] = velocity
+    state.physic_speed[rows] = physic_speed
+    state.previos_distance[rows] = prev_dist
+    state.pos[rows] = new_pos
+    rows_moved = rows[moved]
+    state.current_distance[rows_moved] = cur_dist[moved]
+    state.effective_speed[rows_moved] = prev_dist[moved] - cur_dist[moved]
+
+
+def _row_field(name):
+    """
+    Property reading and writing one row of an engine array.
+    """
+    def get(self):
+        return getattr(self.model.engine, name)[self.row]
+
+    def set(self, value):
+        getattr(self.model.engine, name)[self.row] = value
+
+    return property(get, set)
+
+
+class BoidView:
+    """
+    A boid of the vector engine: a thin view over one row of the engine's
+    arrays, carrying no state of its own besides its id and row.
+
+    Exposes the same attributes as Boid, so agent reporters and the
+    visualization work unchanged. A view is only valid while its agent is in
+    the model; the row is reused by a later agent once it departs.
+    """
+
+    __slots__ = ('unique_id', 'model', 'row')
+
+    def __init__(self, unique_id, model, row):
+        self.unique_id = unique_id
+        self.model = model
+        self.row = row
+
+    pos = _row_field('pos')
+    velocity = _row_field('velocity')
+    destination = _row_field('destination')
+    speed = _row_field('speed')
+    od_dist = _row_field('od_dist')
+    init_time = _row_field('init_time')
+    entry_time = _row_field('entry_time')
+    previos_distance = _row_field('previos_distance')
+    current_distance = _row_field('current_distance')
+    effective_speed = _row_field('effective_speed')
+    physic_speed = _row_field('physic_speed')
+    freeflow_endtime = _row_field('freeflow_endtime')
+    enroute_del = _row_field('enroute_del')
+    n_conf = _row_field('n_conf')
+    n_intrusion = _row_field('n_intrusion')
+
+    @property
+    def vision(self):
+        return self.model.vision
+
+    @property
+    def separation(self):
+        return self.model.separation
+
+    @property
+    def current_time(self):
+        return self.model.engine.step_time
+
+    @property
+    def random(self):
+        return self.model.random
+
+    def distance(self):
+        x1, y1 = self.pos
+        x2, y2 = self.destination
+        return np.sqrt((x1 - x2)**2 + (y1 - y2)**2)
+
+    def step(self):
+        """
+        Boids of the vector engine are stepped by VectorEngine.step.
+        """
+        pass
+
+
+class VectorEngine:
+    """
+    Array-backed state of all boids, queued and placed.
+
+    Position, velocity and destination share one (N,6) float64 block (with
+    (N,2) views pos, velocity and destination); the other fields are
+    one-dimensional arrays. Rows are handed out from a pool when a boid is
+    created and recycled through a free list when it departs, so the arrays
+    only grow with the peak population.
+    """
+
+    _fields = ('kinematics', 'speed', 'od_dist', 'init_time', 'entry_time',
+               'previos_distance', 'current_distance', 'effective_speed',
+               'physic_speed', 'freeflow_endtime', 'enroute_del', 'n_conf',
+               'n_intrusion', 'alive', 'agents')
+
+    def __init__(self, model, capacity=256):
+        self.model = model
+        self.capacity = 0
+        self.size = 0
+        self.free = []
+        self.count = 0
+        self.step_time = 0
+
+        self.kinematics = np.zeros((0, 6))
+        self.speed = np.zeros(0)
+        self.od_dist = np.zeros(0)
+        self.init_time = np.zeros(0)
+        self.entry_time = np.zeros(0)
+        self.previos_distance = np.zeros(0)
+        self.current_distance = np.zeros(0)
+        self.effective_speed = np.zeros(0)
+        self.physic_speed = np.zeros(0)
+        self.freeflow_endtime = np.zeros(0)
+        self.enroute_del = np.zeros(0)
+        self.n_conf = np.zeros(0)
+        self.n_intrusion = np.zeros(0)
+        self.alive = np.zeros(0, dtype=bool)
+        self.agents = np.empty(0, dtype=object)
+
+        self._grow(capacity)
+
+    def _grow(self, capacity):
+        for name in self._fields:
+            old = getattr(self, name)
+            new = np.empty((capacity,) + old.shape[1:], dtype=old.dtype)
+            new[:len(old)] = old
+            new[len(old):] = None if old.dtype == object else 0
+            setattr(self, name, new)
+        self.pos = self.kinematics[:, 0:2]
+        self.velocity = self.kinematics[:, 2:4]
+        self.destination = self.kinematics[:, 4:6]
+        self.capacity = capacity
+
+    def __len__(self):
+        return self.count
+
+    def new_boid(self, unique_id, pos, velocity, destination, speed,
+                 init_time=0):
+        """
+        Take a row for a new boid and return its view. The boid is not
+        stepped until it is placed.
+        """
+        if self.free:
+            row = self.free.pop()
+        else:
+            if self.size == self.capacity:
+                self._grow(max(2*self.capacity, 1))
+            row = self.size
+            self.size += 1
+
+        self.pos[row] = pos
+        self.velocity[row] = velocity
+        self.destination[row] = destination
+        self.speed[row] = speed
+        self.effective_speed[row] = speed
+        self.physic_speed[row] = speed
+        self.init_time[row] = init_time
+        for name in ('od_dist', 'entry_time', 'previos_distance',
+                     'current_distance', 'freeflow_endtime', 'enroute_del',
+                     'n_conf', 'n_intrusion'):
+            getattr(self, name)[row] = 0
+        boid = BoidView(unique_id, self.model, row)
+        self.agents[row] = boid
+        return boid
+
+    def add(self, boid):
+        """
+        Place a boid created with new_boid.
+        """
+        self.alive[boid.row] = True
+        self.count += 1
+
+    def remove(self, boid):
+        """
+        Take a placed boid out and release its row.
+        """
+        self.alive[boid.row] = False
+        self.agents[boid.row] = None
+        self.free.append(boid.row)
+        self.count -= 1
+
+    def active(self):
+        """
+        Row indices of all placed agents.
+        """
+        return np.flatnonzero(self.alive[:self.size])
+
+    def step(self):
+        """
+        Advance every placed boid by one step.
+        """
+        model = self.model
+        space = model.space
+        schedule = model.schedule
+        profiler = model.profiler
+        rows = self.active()
+        travelled = 0.0
+
+        if len(rows):
+            pos = self.pos[rows]
+            dest = self.destination[rows]
+            speed = self.speed[rows]
+
+            desired, prev_dist = desired_velocity(pos, dest, speed)
+
+            # Per-boid conflict and intrusion counts, for the zones.
+            counts = None
+            if model.zones is not None:
+                counts = np.zeros((len(rows), 2))
+
+            with profiler.phase('neighbors'):
+                if model.conflict == 'pairwise':
+                    own, intruder = unique_pairs(pos, model.vision,
+                                                 model.neighbor_index)
+                elif model.neighbor_index is None:
+                    own, intruder = pairs_within(pos, model.vision)
+                else:
+                    model.neighbor_index.build(pos)
+                    own, intruder = csr_pairs(
+                        *model.neighbor_index.query(pos, model.vision))
+            profiler.count('neighbor_pairs', len(own))
+            with profiler.phase('mvp'):
+                if model.conflict == 'pairwise':
+                    delta, n_confs, n_intrusion = resolve_pairs(
+                        pos, desired, own, intruder, model.separation,
+                        counts=counts)
+                else:
+                    delta, n_confs, n_intrusion = mvp_pairs(
+                        pos, desired, self.velocity[rows], speed,
+                        model.separation, own, intruder, counts)
+            model.n_confs += n_confs
+            model.n_intrusion += n_intrusion
+            if counts is not None:
+                self.n_conf[rows] = counts[:, 0]
+                self.n_intrusion[rows] = counts[:, 1]
+            moving = profiler.clock()
+
+            (velocity, physic_speed, new_pos, moved, cur_dist, travelled,
+             arrived) = move_boids(pos, dest, speed, desired, delta,
+                                   (space.x_min, space.x_max,
+                                    space.y_min, space.y_max))
+            store_move(self, rows, prev_dist, velocity, physic_speed, new_pos,
+                       moved, cur_dist)
+            travelled = travelled[moved].sum()
+            model.kill_agents.extend(self.agents[rows[arrived]])
+
+            profiler.add('move', profiler.clock() - moving)
+
+        model.acc.recount(self.pos[rows], self.physic_speed[rows],
+                          self.effective_speed[rows], travelled)
+        self.step_time = schedule.time
+        schedule.steps += 1
+        schedule.time += 1
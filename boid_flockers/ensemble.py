@@ -0,0 +1,408 @@
+"""
+Ensembles
+=============================================================
+Many independent replications of one scenario, stepped together.
+
+Replicating a scenario with BoidFlockers means one model per replication,
+each with its own scheduler, space and agent objects. Ensemble keeps the
+boids of all R replications in one set of arrays, tagged with their
+replication id, and advances them all with the vector engine's kernels in
+one batched pass per step:
+
+    ensemble = Ensemble(30, seed=0, rate=300, vision=4, separation=1)
+    ensemble.run(1200)
+    ensemble.model_vars(0)        # like get_model_vars_dataframe()
+    ensemble.summary()            # settled MFD point with its spread
+
+Spatial queries are partitioned by replication by shifting every
+replication's positions by its own x offset, wider than the airspace plus
+the query radius, before they are indexed. A single GridIndex then serves
+all replications and never pairs boids from different ones. Reporters are
+summed per replication with np.bincount over the replication ids.
+
+Every replication draws its arrivals and OD pairs from its own generator,
+seeded like BoidFlockers(seed=ensemble.seeds[r]), and follows the same step
+as BoidFlockers(engine='vector') with the same conflict mode. Only the
+'mvp' and 'pairwise' conflict modes are supported. Neighbors are summed in
+a different order than in a lone model, so a replication matches its
+BoidFlockers run up to rounding; with 'mvp' those differences can grow
+into a different (but equally likely) trajectory over a long run.
+"""
+import numpy as np
+import pandas as pd
+from mesa.space import ContinuousSpace
+
+from .model import BoidFlockers, model_reporters
+from .engine import desired_velocity, move_boids, mvp_pairs, store_move
+from .conflict import resolve_pairs
+from .departures import admissible
+from .metrics import MFDReporter, in_box, measurement_box
+from .spatial import csr_pairs, make_index, pairs_within
+from .sweep import tail_means
+
+
+class _Replication:
+    """
+    Random state of one replication: its generator and the OD sampler of
+    BoidFlockers.
+    """
+
+    draw_points = BoidFlockers.draw_points
+    make_ods = BoidFlockers.make_ods
+
+    def __init__(self, seed, space, size_factor, angle_min, angle_max):
+        self.rng = np.random.default_rng(seed)
+        # BoidFlockers draws its scheduler seed first.
+        self.rng.integers(2**63)
+        self.space = space
+        self.size_factor = size_factor
+        self.angle_min = angle_min
+        self.angle_max = angle_max
+        self._od_drawn = 0
+        self._od_valid = 0
+        self._od_acceptance = max((angle_max - angle_min)/360, 1e-3)
+
+
+class Ensemble:
+    """
+    R replications of one BoidFlockers scenario in stacked arrays.
+
+    Args:
+        replications: Number of replications R.
+        seed: Seed the replication seeds are spawned from (see sweep_grid).
+        seeds: Explicit list of replication seeds instead.
+        neighbor_index: 'grid' (default), 'kdtree' or None.
+        conflict: 'mvp' or 'pairwise'.
+        Other arguments as for BoidFlockers.
+    """
+
+    _fields = ('kinematics', 'speed', 'od_dist', 'init_time',
+               'freeflow_endtime', 'previos_distance', 'current_distance',
+               'effective_speed', 'physic_speed', 'rep', 'alive')
+
+    # The model reporters of BoidFlockers, in the same order.
+    columns = tuple(model_reporters)
+
+    def __init__(
+            self,
+            replications=10,
+            seed=0,
+            seeds=None,
+            width=100,
+            height=100,
+            speed=1,
+            vision=10,
+            separation=2,
+            rate=10,
+            size_factor=2,
+            sim_length=1200,
+            angle_min=-180,
+            angle_max=180,
+            neighbor_index='grid',
+            conflict='mvp',
+            capacity=1024):
+        if conflict not in ('mvp', 'pairwise'):
+            raise ValueError(
+                "Ensembles support conflict='mvp' or 'pairwise', "
+                "not {!r}".format(conflict))
+        if seeds is None:
+            seeds = [int(s.generate_state(1)[0]) for s in
+                     np.random.SeedSequence(seed).spawn(replications)]
+        self.seeds = list(seeds)
+        self.replications = R = len(self.seeds)
+
+        self.def_speed = speed
+        self.vision = vision
+        self.separation = separation
+        self.rate = rate
+        self.size_factor = size_factor
+        self.sim_length = sim_length
+        self.conflict = conflict
+        self.space = ContinuousSpace(width, height, False)
+        self.box = measurement_box(self)
+        self.neighbor_index = make_index(neighbor_index, vision, separation)
+        self.offset = np.arange(R)*(width + 2*max(vision, separation) + 1)
+
+        self.reps = [_Replication(s, self.space, size_factor, angle_min,
+                                  angle_max) for s in self.seeds]
+        self.time = 0
+        self.steps = 0
+
+        # Cumulative per-replication totals.
+        self.dep_del = np.zeros(R)
+        self.enroute_del = np.zeros(R)
+        self.arrival = np.zeros(R, dtype=np.int64)
+        self.departure = np.zeros(R, dtype=np.int64)
+        self.vkt = np.zeros(R)
+        self.occupancy_time = np.zeros(R)
+
+        # Row pool as in VectorEngine; the queue holds rows in arrival order.
+        self.capacity = 0
+        self.size = 0
+        self.free = []
+        self.queue = np.zeros(0, dtype=np.intp)
+        self.kinematics = np.zeros((0, 6))
+        for name in self._fields[1:]:
+            setattr(self, name, np.zeros(0))
+        self.rep = np.zeros(0, dtype=np.intp)
+        self.alive = np.zeros(0, dtype=bool)
+        self._grow(capacity)
+
+        self._series_steps = 0
+        self._series = np.zeros((256, R, len(self.columns)))
+
+    def _grow(self, capacity):
+        for name in self._fields:
+            old = getattr(self, name)
+            new = np.zeros((capacity,) + old.shape[1:], dtype=old.dtype)
+            new[:len(old)] = old
+            setattr(self, name, new)
+        self.pos = self.kinematics[:, 0:2]
+        self.velocity = self.kinematics[:, 2:4]
+        self.destination = self.kinematics[:, 4:6]
+        self.capacity = capacity
+
+    def _take(self, n):
+        """
+        Rows for n new boids, reusing freed rows first.
+        """
+        reused = self.free[len(self.free) - min(n, len(self.free)):][::-1]
+        del self.free[len(self.free) - len(reused):]
+        fresh = n - len(reused)
+        if self.size + fresh > self.capacity:
+            self._grow(max(2*self.capacity, self.size + fresh))
+        rows = np.concatenate([np.array(reused, dtype=np.intp),
+                               np.arange(self.size, self.size + fresh)])
+        self.size += fresh
+        return rows
+
+    def active(self):
+        """
+        Rows of all placed boids, of every replication.
+        """
+        return np.flatnonzero(self.alive[:self.size])
+
+    def _per_rep(self, rows, weights=None):
+        return np.bincount(self.rep[rows], weights=weights,
+                           minlength=self.replications)
+
+    def _arrivals(self):
+        """
+        Draw this step's arrivals of every replication, like
+        BoidFlockers.agent_maker, and append them to the queue.
+        """
+        R = self.replications
+        input_rate = np.zeros(R, dtype=np.int64)
+        if self.time >= self.sim_length:
+            return input_rate
+        per_step = self.rate/60
+        fractional = per_step % 1
+        integer = int(per_step - round(fractional))
+        origins, destinations, velocities = [], [], []
+        for r, rep in enumerate(self.reps):
+            n = int(integer + rep.rng.binomial(n=1, p=fractional))
+            o, d = rep.make_ods(n)
+            origins.append(o)
+            destinations.append(d)
+            velocities.append(rep.rng.random((n, 2))*2 - 1)
+            input_rate[r] = n
+
+        rows = self._take(int(input_rate.sum()))
+        self.pos[rows] = np.concatenate(origins)
+        self.destination[rows] = np.concatenate(destinations)
+        self.velocity[rows] = np.concatenate(velocities)
+        self.speed[rows] = self.def_speed
+        self.effective_speed[rows] = self.def_speed
+        self.physic_speed[rows] = self.def_speed
+        self.previos_distance[rows] = 0
+        self.current_distance[rows] = 0
+        self.init_time[rows] = self.time
+        self.od_dist[rows] = np.sqrt(
+            ((self.pos[rows] - self.destination[rows])**2).sum(axis=1))
+        self.rep[rows] = np.repeat(np.arange(R), input_rate)
+        self.queue = np.concatenate([self.queue, rows])
+        return input_rate
+
+    def shifted(self, rows):
+        """
+        Positions of rows moved to their replication's partition.
+        """
+        pos = self.pos[rows].copy()
+        pos[:, 0] += self.offset[self.rep[rows]]
+        return pos
+
+    def _departures(self):
+        """
+        Admit queued boids whose origin is clear, per replication in FIFO
+        order (see departures.admissible).
+        """
+        admitted = self.queue[admissible(self.shifted(self.queue),
+                                         self.shifted(self.active()),
+                                         self.separation)]
+        self.queue = self.queue[~np.isin(self.queue, admitted)]
+        self.alive[admitted] = True
+        self.freeflow_endtime[admitted] = (
+            self.time + self.od_dist[admitted]/self.speed[admitted])
+        self.dep_del += self._per_rep(admitted,
+                                      self.time - self.init_time[admitted])
+        self.arrival += self._per_rep(admitted)
+
+    def _move(self):
+        """
+        The VectorEngine step over all replications.
+
+        Returns:
+            (rows of arrived boids, conflicts, intrusions) per replication.
+        """
+        rows = self.active()
+        R = self.replications
+        if len(rows) == 0:
+            return rows, np.zeros(R), np.zeros(R)
+        space = self.space
+        pos = self.pos[rows]
+        dest = self.destination[rows]
+        speed = self.speed[rows]
+        desired, prev_dist = desired_velocity(pos, dest, speed)
+
+        shifted = self.shifted(rows)
+        index = self.neighbor_index
+        counts = np.zeros((len(rows), 2))
+        if self.conflict == 'pairwise':
+            if index is None:
+                i, j = pairs_within(shifted, self.vision)
+                once = i < j
+                i, j = i[once], j[once]
+            else:
+                i, j = index.build(shifted).pairs(self.vision)
+            delta, _, _ = resolve_pairs(pos, desired, i, j, self.separation,
+                                        counts=counts)
+        else:
+            if index is None:
+                own, intruder = pairs_within(shifted, self.vision)
+            else:
+                index.build(shifted)
+                own, intruder = csr_pairs(*index.query(shifted, self.vision))
+            delta, _, _ = mvp_pairs(pos, desired, self.velocity[rows], speed,
+                                    self.separation, own, intruder, counts)
+        confs = self._per_rep(rows, counts[:, 0])
+        intrusions = self._per_rep(rows, counts[:, 1])
+
+        (velocity, physic_speed, new_pos, moved, cur_dist, travelled,
+         arrived) = move_boids(pos, dest, speed, desired, delta,
+                               (space.x_min, space.x_max,
+                                space.y_min, space.y_max))
+        store_move(self, rows, prev_dist, velocity, physic_speed, new_pos,
+                   moved, cur_dist)
+        self.vkt += self._per_rep(rows[moved], travelled[moved])
+        arrived = rows[arrived]
+        return arrived, confs, intrusions
+
+    def step(self):
+        """
+        Advance every replication by one step.
+        """
+        input_rate = self._arrivals()
+        self._departures()
+        arrived, confs, intrusions = self._move()
+
+        self.departure += self._per_rep(arrived)
+        self.enroute_del += self._per_rep(arrived, np.maximum(
+            self.time - self.freeflow_endtime[arrived], 0))
+        self.alive[arrived] = False
+        self.free.extend(arrived.tolist())
+
+        rows = self.active()
+        num_agents = self._per_rep(rows)
+        inside = rows[in_box(self.pos[rows], self.box)]
+        occupancy = self._per_rep(inside)
+        flow = self._per_rep(inside, self.physic_speed[inside])
+        eff_flow = self._per_rep(inside, self.effective_speed[inside])
+        self.occupancy_time += occupancy
+        with np.errstate(divide='ignore', invalid='ignore'):
+            speed = np.where(num_agents > 0, flow/num_agents, np.nan)
+            eff_speed = np.where(num_agents > 0, eff_flow/num_agents, np.nan)
+
+        self.time += 1
+        self.steps += 1
+        values = dict(zip(MFDReporter.columns,
+                          (occupancy, flow, eff_flow, eff_speed, speed)))
+        values.update({"Inpute rate": input_rate*60,
+                       "Output rate": self._per_rep(arrived)*60,
+                       "Queue length": self._per_rep(self.queue),
+                       "size": self.size_factor,
+                       "inp_rate": self.rate,
+                       "vision": self.vision,
+                       "def_speed": self.def_speed,
+                       "sep": self.separation,
+                       "Departure Delay": self.dep_del,
+                       "Enroute Delay": self.enroute_del,
+                       "Total Delay": self.dep_del + self.enroute_del,
+                       "N Conflicts": confs,
+                       "N Intrusions": intrusions,
+                       "N Arrivals": self.arrival,
+                       "N Departures": self.departure,
+                       "VKT": self.vkt,
+                       "Occupancy time": self.occupancy_time})
+        self._record(values)
+
+    def _record(self, values):
+        """
+        Append one step of reporter values, by column name.
+        """
+        if self._series_steps == len(self._series):
+            grown = np.zeros((2*len(self._series),) + self._series.shape[1:])
+            grown[:self._series_steps] = self._series
+            self._series = grown
+        row = self._series[self._series_steps]
+        for k, name in enumerate(self.columns):
+            row[:, k] = values[name]
+        self._series_steps += 1
+
+    def run(self, steps):
+        for _ in range(steps):
+            self.step()
+        return self
+
+    def array(self):
+        """
+        (steps, replications, columns) array of the reporter series.
+        """
+        return self._series[:self._series_steps]
+
+    def model_vars(self, replication):
+        """
+        Reporter series of one replication, laid out like
+        BoidFlockers.datacollector.get_model_vars_dataframe().
+        """
+        return pd.DataFrame(self.array()[:, replication],
+                            columns=self.columns)
+
+    def to_frame(self):
+        """
+        Long DataFrame of every replication's series, with "time" and
+        "replication" columns, like load_sweep.
+        """
+        steps, R, _ = self.array().shape
+        frame = pd.DataFrame(self.array().reshape(-1, len(self.columns)),
+                             columns=self.columns)
+        frame["time"] = np.repeat(np.arange(steps), R)
+        frame["replication"] = np.tile(np.arange(R), steps)
+        frame["seed"] = np.tile(self.seeds, steps)
+        return frame
+
+    def summary(self, tail=0.5, z=1.96):
+        """
+        Settled occupancy and flow of the scenario across replications.
+
+        Returns:
+            (runs, point): the tail_means of every replication, and their
+            mean, standard deviation and the half width of the normal
+            confidence interval z*std/sqrt(R).
+        """
+        runs = pd.DataFrame([tail_means(self.model_vars(r), tail)
+                             for r in range(self.replications)])
+        runs.insert(0, "seed", self.seeds)
+        values = runs[["occupancy", "flow"]]
+        point = pd.DataFrame({"mean": values.mean(), "std": values.std()})
+        point["ci"] = z*point["std"]/np.sqrt(len(runs))
+        return runs, point
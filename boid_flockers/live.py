@@ -0,0 +1,184 @@
+"""
+Live runner
+=============================================================
+Steps a model continuously in the background and publishes its latest
+state at a fixed frame rate, independent of the browser.
+
+With the stock ModularServer the model only advances when the browser asks
+for the next step, so the simulation runs at the speed of the UI round-trip
+and rendering. LiveServer instead runs an AsyncRunner on the server's
+asyncio loop: steps are taken in a worker thread in batches of about one
+frame's duration, and after every batch the visualization is rendered once
+if a frame is due. A browser poll ("get_step") only returns the latest
+rendered frame, so any number of clients can watch without slowing the run
+down, and the charts receive one point per frame (a downsampled series)
+rather than one per step.
+
+The runner pauses when no client has polled for idle_timeout seconds, i.e.
+when every browser pressed Stop or went away.
+
+    python run.py --live --fps 10
+"""
+import asyncio
+import time
+
+import tornado.escape
+from mesa.visualization.ModularVisualization import (ModularServer,
+                                                     SocketHandler)
+
+
+class AsyncRunner:
+    """
+    Advance a model in a background thread and publish frames at fps.
+
+    Args:
+        model: The model to step.
+        publish: Called on the loop thread with the model whenever a frame
+                is due; nothing else touches the model meanwhile.
+        fps: Frames published per second.
+        max_steps: Stop after this many model steps (None: until the model
+                stops running).
+    """
+
+    def __init__(self, model, publish, fps=10, max_steps=None):
+        self.model = model
+        self.publish = publish
+        self.fps = fps
+        self.max_steps = max_steps
+        self.task = None
+        self._stop = False
+        self.steps = 0
+
+    @property
+    def active(self):
+        return self.task is not None and not self.task.done()
+
+    @property
+    def finished(self):
+        return (not self.model.running or
+                (self.max_steps is not None and self.steps >= self.max_steps))
+
+    def advance(self, seconds):
+        """
+        Step the model for about `seconds` (at least one step).
+        """
+        end = time.perf_counter() + seconds
+        while not self.finished and not self._stop:
+            self.model.step()
+            self.steps += 1
+            if time.perf_counter() >= end:
+                break
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        frame = 1/self.fps
+        next_frame = time.perf_counter()
+        while not self.finished and not self._stop:
+            await loop.run_in_executor(
+                None, self.advance, max(next_frame - time.perf_counter(), 0))
+            if time.perf_counter() >= next_frame or self.finished:
+                self.publish(self.model)
+                next_frame = time.perf_counter() + frame
+
+    def start(self):
+        if not self.active:
+            self._stop = False
+            self.task = asyncio.get_event_loop().create_task(self.run())
+        return self.task
+
+    async def stop(self):
+        """
+        Stop after the batch in progress; the model is safe to touch once
+        this returns.
+        """
+        self._stop = True
+        if self.task is not None:
+            await self.task
+
+
+class LiveSocketHandler(SocketHandler):
+    """
+    Websocket handler that answers a step request with the next frame
+    published after the one this client saw last, instead of stepping the
+    model itself.
+    """
+
+    seen = -1
+
+    async def on_message(self, message):
+        app = self.application
+        msg = tornado.escape.json_decode(message)
+        if msg["type"] == "get_step":
+            app.last_poll = time.perf_counter()
+            if not app.runner.finished:
+                app.runner.start()
+            if self.seen == app.frame:
+                if app.runner.finished:
+                    self.write_message({"type": "end"})
+                    return
+                await app.next_frame()
+            self.seen = app.frame
+            self.write_message({"type": "viz_state", "data": app.latest})
+        elif msg["type"] == "reset":
+            await app.runner.stop()
+            app.reset_model()
+            self.seen = app.frame
+            self.write_message({"type": "viz_state", "data": app.latest})
+        else:
+            super().on_message(message)
+
+
+class LiveServer(ModularServer):
+    """
+    ModularServer whose model runs on its own (see module docstring).
+
+    Args:
+        fps: Frames rendered per second while the model runs.
+        idle_timeout: Seconds without a client poll after which the runner
+                pauses.
+        max_steps: Step limit of every run.
+    """
+
+    socket_handler = (r"/ws", LiveSocketHandler)
+    handlers = [ModularServer.page_handler, socket_handler,
+                ModularServer.static_handler, ModularServer.local_handler]
+
+    def __init__(self, model_cls, visualization_elements, name="Mesa Model",
+                 model_params={}, fps=10, idle_timeout=2, max_steps=None):
+        self.fps = fps
+        self.idle_timeout = idle_timeout
+        self.run_max_steps = max_steps
+        self.runner = None
+        super().__init__(model_cls, visualization_elements, name,
+                         model_params)
+
+    def reset_model(self):
+        super().reset_model()
+        self.last_poll = time.perf_counter()
+        self.runner = AsyncRunner(self.model, self.publish, self.fps,
+                                  self.run_max_steps)
+        self.frame = getattr(self, "frame", 0)
+        self._frame_event = asyncio.Event()
+        self.publish(self.model)
+
+    def publish(self, model):
+        """
+        Render the model into self.latest and wake the waiting clients.
+        """
+        self.latest = self.render_model()
+        self.frame += 1
+        self._frame_event.set()
+        self._frame_event = asyncio.Event()
+        if time.perf_counter() - self.last_poll > self.idle_timeout:
+            self.runner._stop = True
+
+    async def next_frame(self):
+        """
+        Wait until the next frame is published, or the runner ends.
+        """
+        event = self._frame_event
+        while not event.is_set() and self.runner.active:
+            try:
+                await asyncio.wait_for(event.wait(), self.idle_timeout)
+            except asyncio.TimeoutError:
+                pass
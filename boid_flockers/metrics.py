@@ -0,0 +1,83 @@
+"""
+MFD metrics
+=============================================================
+Single-pass measurement of the macroscopic fundamental diagram quantities.
+
+The measurement region is the center box of the airspace scaled by
+size_factor. Occupancy and total/effective flow in the box are read from
+the model's running totals (see accumulators.py), and the speeds derived
+from them, once per step.
+"""
+import numpy as np
+
+
+def population_arrays(model):
+    """
+    Positions, physical speeds and effective speeds of all placed boids.
+    """
+    if model.engine is not None:
+        engine = model.engine
+        rows = engine.active()
+        return (engine.pos[rows], engine.physic_speed[rows],
+                engine.effective_speed[rows])
+
+    agents = model.schedule.agents
+    state = np.array([(agent.pos[0], agent.pos[1], agent.physic_speed,
+                       agent.effective_speed) for agent in agents],
+                     dtype=float).reshape(-1, 4)
+    return state[:, :2], state[:, 2], state[:, 3]
+
+
+def measurement_box(model):
+    """
+    (x_lo, x_hi, y_lo, y_hi) bounds of the center measurement box.
+    """
+    space = model.space
+    half_x = space.x_max/2/model.size_factor
+    half_y = space.y_max/2/model.size_factor
+    return (space.x_max/2 - half_x, space.x_max/2 + half_x,
+            space.y_max/2 - half_y, space.y_max/2 + half_y)
+
+
+def in_box(pos, box):
+    x_lo, x_hi, y_lo, y_hi = box
+    return ((pos[:, 0] >= x_lo) & (pos[:, 0] <= x_hi) &
+            (pos[:, 1] >= y_lo) & (pos[:, 1] <= y_hi))
+
+
+class MFDReporter:
+    """
+    Reads all MFD quantities of a step at once and caches them until the
+    schedule advances, so every DataCollector column sees the same values.
+    """
+
+    columns = ("Occupancy", "Total flow", "Effective flow",
+               "Effective speed", "Speed")
+
+    def __init__(self):
+        self.step = None
+        self.values = {}
+
+    def measure(self, model):
+        acc = model.acc
+        flow = acc.flow
+        eff_flow = acc.eff_flow
+        # Speeds are averaged over every agent in the airspace, as before.
+        if model.num_agents:
+            speed = flow/model.num_agents
+            eff_speed = eff_flow/model.num_agents
+        else:
+            speed = eff_speed = None
+
+        self.values = {"Occupancy": acc.occupancy,
+                       "Total flow": flow,
+                       "Effective flow": eff_flow,
+                       "Effective speed": eff_speed,
+                       "Speed": speed}
+        self.step = model.schedule.steps
+        return self.values
+
+    def get(self, model, name):
+        if self.step != model.schedule.steps:
+            self.measure(model)
+        return self.values[name]
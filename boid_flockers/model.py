@@ -4,52 +4,34 @@ Flockers
 A Mesa implementation of Craig Reynolds's Boids flocker model.
 Uses numpy arrays to represent vectors.
 """
+import random
+
 import numpy as np
 from mesa import Model
 from mesa.space import ContinuousSpace
 from mesa.time import RandomActivation
 from mesa.datacollection import DataCollector
 from .boid import Boid
+from .engine import VectorEngine
+from .spatial import make_index
+from .metrics import MFDReporter
+from .accumulators import Accumulators
+from .sink import StreamingDataCollector
+from .departures import DepartureQueue
+from .profiler import StepProfiler, NullProfiler
+from .monitor import make_monitor
+from .downsample import MultiResolutionSeries, chart_rows
+from .zones import make_zones
+from .trajectory import TrajectoryWriter
 
 def compute_N(model):
-    try:
-        N = len([agent for agent in model.schedule.agents \
-                    if agent.pos[0] <= model.space.x_max/2 + \
-                    model.space.x_max/2/model.size_factor and 
-                    agent.pos[0] >= model.space.x_max/2 - \
-                    model.space.x_max/2/model.size_factor and
-                    agent.pos[1] <= model.space.y_max/2 + \
-                    model.space.y_max/2/model.size_factor and 
-                    agent.pos[1] >= model.space.y_max/2 - \
-                    model.space.y_max/2/model.size_factor 
-                    ])
-        return N
-    except: print('N error')
+    return model.mfd.get(model, "Occupancy")
     
 def compute_eff_flow(model):
-    eff_flow = sum([agent.effective_speed for agent in model.schedule.agents \
-                    if agent.pos[0] <= model.space.x_max/2 + \
-                    model.space.x_max/2/model.size_factor and 
-                    agent.pos[0] >= model.space.x_max/2 - \
-                    model.space.x_max/2/model.size_factor and
-                    agent.pos[1] <= model.space.y_max/2 + \
-                    model.space.y_max/2/model.size_factor and 
-                    agent.pos[1] >= model.space.y_max/2 - \
-                    model.space.y_max/2/model.size_factor 
-                    
-                    ])
-    return eff_flow
+    return model.mfd.get(model, "Effective flow")
+
 def compute_flow(model):
-    flow = sum([agent.physic_speed for agent in model.schedule.agents \
-                    if agent.pos[0] <= model.space.x_max/2 + \
-                    model.space.x_max/2/model.size_factor and 
-                    agent.pos[0] >= model.space.x_max/2 - \
-                    model.space.x_max/2/model.size_factor and
-                    agent.pos[1] <= model.space.y_max/2 + \
-                    model.space.y_max/2/model.size_factor and 
-                    agent.pos[1] >= model.space.y_max/2 - \
-                    model.space.y_max/2/model.size_factor ])
-    return flow
+    return model.mfd.get(model, "Total flow")
 
 def compute_inp(model):
     inp = model.input_rate
@@ -60,40 +42,54 @@ def compute_out(model):
     return out*60
 
 def compute_speed(model):
-    try:
-        speed = sum([agent.physic_speed for agent in model.schedule.agents \
-                    if agent.pos[0] <= model.space.x_max/2 + \
-                    model.space.x_max/2/model.size_factor and 
-                    agent.pos[0] >= model.space.x_max/2 - \
-                    model.space.x_max/2/model.size_factor and
-                    agent.pos[1] <= model.space.y_max/2 + \
-                    model.space.y_max/2/model.size_factor and 
-                    agent.pos[1] >= model.space.y_max/2 - \
-                    model.space.y_max/2/model.size_factor ])/model.num_agents
-        return speed
-    except: pass
+    return model.mfd.get(model, "Speed")
 
 def compute_eff_speed(model):
-    try:
-        eff_speed = sum([agent.effective_speed for agent in model.schedule.agents\
-                    if agent.pos[0] <= model.space.x_max/2 + \
-                    model.space.x_max/2/model.size_factor and 
-                    agent.pos[0] >= model.space.x_max/2 - \
-                    model.space.x_max/2/model.size_factor and
-                    agent.pos[1] <= model.space.y_max/2 + \
-                    model.space.y_max/2/model.size_factor and 
-                    agent.pos[1] >= model.space.y_max/2 - \
-                    model.space.y_max/2/model.size_factor ])/model.num_agents
-        return eff_speed
-    except: pass
+    return model.mfd.get(model, "Effective speed")
 
 def compute_queue_len(model):
     return len(model.queue)
 
+def compute_vkt(model):
+    return model.acc.vkt
+
+def compute_occupancy_time(model):
+    return model.acc.occupancy_time
+
+model_reporters = {"Occupancy": compute_N,
+                   "Total flow": compute_flow,
+                   "Effective flow": compute_eff_flow,
+                   "Inpute rate": compute_inp,
+                   "Output rate": compute_out,
+                   'Effective speed': compute_eff_speed ,
+                   'Speed': compute_speed,
+                   'Queue length': compute_queue_len,
+                   'size':'size_factor',
+                   'inp_rate':'rate',
+                   'vision':'vision',
+                   'def_speed':'speed',
+                   'sep':'separation',
+                   'Departure Delay':'dep_del',
+                   'Enroute Delay': 'enroute_del',
+                   'Total Delay': 'tot_del',
+                   'N Conflicts': 'n_confs',
+                   'N Intrusions': 'n_intrusion',
+                   'N Arrivals': 'arrival',
+                   'N Departures': 'departure',
+                   'VKT': compute_vkt,
+                   'Occupancy time': compute_occupancy_time
+                   }
+
 class BoidFlockers(Model):
     """
     Flocker model class. Handles agent creation, placement and scheduling.
     """    
+    def __new__(cls, *args, **kwargs):
+        # Model.__new__ seeds a random.Random from the seed keyword, which
+        # cannot take a Generator; __init__ sets up both RNGs instead.
+        kwargs.pop('seed', None)
+        return super().__new__(cls, *args, **kwargs)
+        
     def __init__(
         self,
         population=100,
@@ -106,7 +102,19 @@ class BoidFlockers(Model):
         size_factor = 2,
         sim_length = 1200,
         angle_min = -180,
-        angle_max = 180):
+        angle_max = 180,
+        engine = 'agent',
+        neighbor_index = None,
+        conflict = 'mvp',
+        sink = None,
+        flush_every = 100,
+        run_id = 0,
+        seed = None,
+        profile = False,
+        monitor = None,
+        chart_points = None,
+        zones = None,
+        trajectories = None):
         """
         Create a new Flockers model.
 
@@ -116,8 +124,53 @@ class BoidFlockers(Model):
             vision: How far around should each Boid look for its neighbors
             separation: What's the minimum distance each Boid will attempt to
                     keep from any other
+            engine: 'agent' steps every Boid through the scheduler,
+                    'vector' advances the whole population in one batched
+                    pass with the VectorEngine.
+            neighbor_index: None queries ContinuousSpace once per agent,
+                    'grid' or 'kdtree' rebuild a spatial index once per step
+                    and answer all vision queries in one batch, with the
+                    same neighbors as None.
+            conflict: 'mvp' resolves conflicts per ownship with Boid.mvp,
+                    'pairwise' (vector engine only) evaluates every pair
+                    once with closest-point-of-approach geometry and splits
+                    the MVP resolution between both aircraft.
+            sink: Directory to stream the collected model and agent rows to
+                    as Parquet files every flush_every steps, partitioned by
+                    run_id. None keeps all rows in memory.
+            seed: Seed or np.random.Generator all stochastic inputs (OD
+                    pairs, initial velocities, arrivals, activation order)
+                    are drawn from. None draws fresh OS entropy.
+            profile: Record per-phase step times and counters in
+                    self.profiler (a StepProfiler).
+            monitor: Stop the run early once it reaches steady state,
+                    gridlocks or its queue diverges (see monitor.py). True
+                    for the default SteadyStateMonitor, or a dict of its
+                    arguments. The reason is kept in self.stop_reason.
+            chart_points: Keep min/mean/max aggregates of the model
+                    reporters in at most this many buckets in self.charts
+                    (a MultiResolutionSeries) for the server's charts.
+            zones: Measurement regions recorded per step in self.zones (a
+                    ZoneRecorder, see zones.py): an int or (nx, ny) grid
+                    over the measurement box, or a dict with "grid" and
+                    "box", or "polygons" and "names".
+            trajectories: Directory to write every boid's position,
+                    velocity and speed to each step, as a memory-mapped
+                    trajectory store (see trajectory.py). Call
+                    self.trajectories.close() at the end of the run to
+                    write its indexes.
                     """
                     
+        self.params = dict(
+            population=population, width=width, height=height, speed=speed,
+            vision=vision, separation=separation, rate=rate,
+            size_factor=size_factor, sim_length=sim_length,
+            angle_min=angle_min, angle_max=angle_max, engine=engine,
+            neighbor_index=neighbor_index, conflict=conflict)
+        self.rng = np.random.default_rng(seed)
+        self._seed = int(self.rng.integers(2**63))
+        self.random = random.Random(self._seed)
+        
         self.population = population
         self.unique_id = 1
         self.vision = vision
@@ -129,11 +182,15 @@ class BoidFlockers(Model):
         
         self.angle_min = angle_min
         self.angle_max = angle_max
+        self._od_drawn = 0
+        self._od_valid = 0
+        self._od_acceptance = max((angle_max - angle_min)/360, 1e-3)
         
         self.running = True
+        self.stop_reason = None
         self.rate = rate
         self.kill_agents = []
-        self.queue = []
+        self.queue = DepartureQueue()
         self.input_rate = 0
         self.num_agents = 0
         
@@ -149,29 +206,31 @@ class BoidFlockers(Model):
         
         self.sim_length = sim_length
         
-        self.datacollector = DataCollector(
-            model_reporters= {"Occupancy": compute_N,
-                              "Total flow": compute_flow,
-                              "Effective flow": compute_eff_flow,
-                              "Inpute rate": compute_inp,
-                              "Output rate": compute_out,
-                              'Effective speed': compute_eff_speed ,
-                              'Speed': compute_speed,
-                              'Queue length': compute_queue_len,
-                              'size':'size_factor',
-                              'inp_rate':'rate',
-                              'vision':'vision',
-                              'def_speed':'speed',
-                              'sep':'separation',
-                              'Departure Delay':'dep_del',
-                              'Enroute Delay': 'enroute_del',
-                              'Total Delay': 'tot_del',
-                              'N Conflicts': 'n_confs',
-                              'N Intrusions': 'n_intrusion',
-                              'N Arrivals': 'arrival',
-                              'N Departures': 'departure'
-                              
-                             },
+        if engine not in ('agent', 'vector'):
+            raise ValueError("Unknown engine: {}".format(engine))
+        if conflict not in ('mvp', 'pairwise'):
+            raise ValueError("Unknown conflict mode: {}".format(conflict))
+        if conflict != 'mvp' and engine != 'vector':
+            raise ValueError(
+                "conflict='{}' needs engine='vector'".format(conflict))
+        self.conflict = conflict
+        self.engine = VectorEngine(self) if engine == 'vector' else None
+        # The agent engine queries candidates a step's moves ahead, see
+        # index_neighbors.
+        radius = vision if engine == 'vector' else vision + 2*speed
+        self.neighbor_index = make_index(neighbor_index, radius, separation)
+        self._neighbor_csr = None
+        self.mfd = MFDReporter()
+        self.acc = Accumulators.for_model(self)
+        self.profiler = StepProfiler() if profile else NullProfiler()
+        self.monitor = make_monitor(monitor)
+        self.zones = make_zones(zones, self)
+        self.trajectories = None
+        if trajectories is not None:
+            self.trajectories = TrajectoryWriter(trajectories)
+        
+        reporters = dict(
+            model_reporters=dict(model_reporters),
             agent_reporters = {'id':'unique_id',
                                 'prev_dist':'previos_distance',
                                 'cur_dist':'current_distance',
@@ -182,50 +241,82 @@ class BoidFlockers(Model):
                                 'x': lambda x: x.pos[0],
                                 'y': lambda x: x.pos[1]}
             )
+        if sink is None:
+            self.datacollector = DataCollector(**reporters)
+        else:
+            self.datacollector = StreamingDataCollector(
+                sink, flush_every=flush_every, run_id=run_id, **reporters)
+        self.charts = None
+        if chart_points:
+            self.charts = MultiResolutionSeries(reporters['model_reporters'],
+                                                chart_points)
+        
+    def draw_points(self, n):
+        """
+        Draw n uniform points in the center box of the airspace, as an
+        (n,2) array.
+        """
+        half = np.array((self.space.x_max/2/self.size_factor,
+                         self.space.y_max/2/self.size_factor))
+        center = np.array((self.space.x_max/2, self.space.y_max/2))
+        return center + self.rng.uniform(-1, 1, size=(n, 2))*half
         
     def make_od(self):
     
-            x = self.space.x_max/2 + np.random.uniform(-1,1)\
-                * self.space.x_max/2/self.size_factor
-            y = self.space.y_max/2 + np.random.uniform(-1,1)\
-                * self.space.y_max/2/self.size_factor
-            pos = np.array((x, y))
-            x_dest = self.space.x_max/2 + np.random.uniform(-1,1) \
-                * self.space.x_max/2/self.size_factor
-            y_dest = self.space.y_max/2 + np.random.uniform(-1,1) \
-                * self.space.y_max/2/self.size_factor
-            dest = np.array((x_dest, y_dest))
+            pos, dest = self.draw_points(2)
             return pos,dest
         
     def make_od2(self):
         
-        valid = False
-        while valid == False:
-                x = self.space.x_max/2 + np.random.uniform(-1,1)\
-                    * self.space.x_max/2/self.size_factor
-                y = self.space.y_max/2 + np.random.uniform(-1,1)\
-                    * self.space.y_max/2/self.size_factor
-                pos = np.array((x, y))
-                
-                x_dest = self.space.x_max/2 + np.random.uniform(-1,1) \
-                    * self.space.x_max/2/self.size_factor
-                y_dest = self.space.y_max/2 + np.random.uniform(-1,1) \
-                    * self.space.y_max/2/self.size_factor
-                dest = np.array((x_dest, y_dest))
-                
-                vector = (dest - pos)/np.linalg.norm((dest - pos))
-                angle = np.arctan2(vector[0],vector[1]) * 180 / np.pi
-                
-                if angle >= self.angle_min and angle <= self.angle_max:
-                    valid =True
-                else: continue
-        return pos, dest
+        origins, destinations = self.make_ods(1)
+        return origins[0], destinations[0]
+        
+    def make_ods(self, n):
+        """
+        Draw n origin-destination pairs whose heading lies inside
+        [angle_min, angle_max].
+        
+        Candidates are drawn in blocks sized from the acceptance rate seen so
+        far and filtered with array ops, so narrow sectors cost a few large
+        draws instead of many scalar ones.
         
-    def make_agents(self, od, init_time):
+        Returns:
+            (origins, destinations) as (n,2) arrays.
+        """
+        if self.angle_min > self.angle_max:
+            raise ValueError("angle_min must not exceed angle_max")
+        origins, destinations = [], []
+        needed = n
+        while needed > 0:
+            block = int(np.ceil(1.2*needed/self._od_acceptance)) + 8
+            points = self.draw_points(2*block).reshape(block, 2, 2)
+            vector = points[:, 1] - points[:, 0]
+            angle = np.arctan2(vector[:, 0], vector[:, 1]) * 180 / np.pi
+            valid = ((angle >= self.angle_min) & (angle <= self.angle_max) &
+                     np.any(vector != 0, axis=1))
+            accepted = points[valid][:needed]
+            
+            self._od_drawn += block
+            self._od_valid += int(np.count_nonzero(valid))
+            self._od_acceptance = max(self._od_valid/self._od_drawn, 1e-3)
+            
+            origins.append(accepted[:, 0])
+            destinations.append(accepted[:, 1])
+            needed -= len(accepted)
+        if n == 0:
+            return np.zeros((0, 2)), np.zeros((0, 2))
+        return np.concatenate(origins), np.concatenate(destinations)
+        
+    def make_agents(self, od, init_time, velocity=None):
 
             pos = od[0]
             dest = od[1]            
-            velocity = np.random.random(2) * 2 - 1
+            if velocity is None:
+                velocity = self.rng.random(2) * 2 - 1
+            
+            if self.engine is not None:
+                return self.engine.new_boid(self.unique_id, pos, velocity,
+                                            dest, self.speed, init_time)
             
             boid = Boid(
                 unique_id=self.unique_id,
@@ -241,57 +332,93 @@ class BoidFlockers(Model):
             return boid
 
     def place_boid(self, boid):
-        self.space.place_agent(boid, boid.pos)
+        if self.engine is None:
+            self.space.place_agent(boid, boid.pos)
+        else:
+            self.engine.add(boid)
         self.schedule.add(boid)
+        self.acc.add(self.acc.share(boid))
+        
+    def remove_boid(self, boid):
+        self.acc.add(self.acc.share(boid), -1)
+        self.schedule.remove(boid)
+        if self.engine is None:
+            self.space.remove_agent(boid)
+        else:
+            self.engine.remove(boid)
+        
+    def positions(self):
+        """
+        (N,2) array with the positions of all placed boids.
+        """
+        if self.engine is not None:
+            return self.engine.pos[self.engine.active()]
+        if self.space._agent_points is None:
+            return np.zeros((0, 2))
+        return self.space._agent_points
+        
+    def index_neighbors(self):
+        """
+        Rebuild the neighbor index and find every boid's neighbor candidates.
+
+        Boids move one after another within a step, so a boid's neighbors
+        are those within vision of the positions at the time it moves. The
+        index is built from the space's start-of-step points and queried
+        with vision + 2*speed, which covers every boid that can be within
+        vision by then; indexed_neighbors filters the candidates by their
+        current distance, giving the same neighbors as space.get_neighbors.
+        """
+        points = self.positions()
+        self.neighbor_index.build(points)
+        self._neighbor_csr = self.neighbor_index.query(
+            points, self.vision + 2*self.speed, include_center=True)
+
+    def indexed_neighbors(self, agent):
+        """
+        Neighbors of agent within vision of the current positions, from
+        the candidates of index_neighbors.
+        """
+        space = self.space
+        indptr, indices = self._neighbor_csr
+        k = space._agent_to_index[agent]
+        candidates = indices[indptr[k]:indptr[k + 1]]
+        deltas = space._agent_points[candidates] - agent.pos
+        d2 = deltas[:, 0]**2 + deltas[:, 1]**2
+        # In point order, the order get_neighbors returns.
+        within = np.sort(candidates[(d2 <= self.vision**2) & (d2 > 0)])
+        return [space._index_to_agent[j] for j in within]
         
     def agent_maker(self):
         per_step = self.rate/60
         fractional = per_step % 1
         integer = int(per_step - round(fractional))
-        num_frac = np.random.binomial(size=1, n=1, p= fractional)
+        num_frac = self.rng.binomial(n=1, p= fractional)
         self.input_rate = int(integer+num_frac)
         #create agents
+        origins, destinations = self.make_ods(self.input_rate)
+        velocities = self.rng.random((self.input_rate, 2)) * 2 - 1
        
         for i in range(self.input_rate):
-            od = self.make_od2()
-            agent = self.make_agents(od, init_time = self.schedule.time)
+            od = (origins[i], destinations[i])
+            agent = self.make_agents(od, init_time = self.schedule.time,
+                                     velocity = velocities[i])
             agent.od_dist = agent.distance()
             self.unique_id += 1
-            
-            if self.num_agents >= 1:
-                neighbors = self.space.get_neighbors(od[0], self.separation, False)
-                if len(neighbors) == 0:
-                    agent.entry_time = self.schedule.time
-                    self.place_boid(agent)
-                    self.arrival += 1
-                    self.num_agents += 1
-                    #print('first attempt!')
-                else:
-                    self.queue.append(agent)
-                    
-            if self.num_agents == 0: 
-                agent.entry_time = self.schedule.time
-                self.place_boid(agent)
-                self.arrival += 1
-                self.num_agents += 1
-            
+            self.queue.append(agent)
             
     def queue_clearer(self, time):
-        for index, agent in enumerate(self.queue):
-            od = agent.pos
-            # print(od)
-            neighbors = self.space.get_neighbors(od[0], self.separation, False)
-            if len(neighbors) == 0:
-                agent.entry_time = time
-                # agent.dep_del = max(agent.entry_time - agent.init_time,0)
-                # print('second attempt!',agent.unique_id,agent.init_time, agent.entry_time, agent.dep_del)
-                self.dep_del += agent.entry_time - agent.init_time
-                self.place_boid(agent)
-                self.arrival += 1
-                self.num_agents += 1
-                del self.queue[index]
-            else:
-                pass
+        """
+        Let every queued agent whose origin is clear depart, in FIFO order.
+        New arrivals join the back of the queue in agent_maker, so they get
+        their first attempt in the same step they are created.
+        """
+        for agent in self.queue.admit(self.positions(), self.separation):
+            agent.entry_time = time
+            self.dep_del += agent.entry_time - agent.init_time
+            self.acc.entered(agent)
+            self.place_boid(agent)
+            self.arrival += 1
+            self.num_agents += 1
         
     def step(self):
         """
@@ -302,23 +429,55 @@ class BoidFlockers(Model):
         self.n_confs = 0
         self.n_intrusion = 0
         
+        profiler = self.profiler
+        profiler.start_step(self.schedule.time)
+        
         #compute input rate for step
-        if self.schedule.time <self.sim_length:
-            self.agent_maker()
-        else: pass
-        self.queue_clearer(time= self.schedule.time)
+        with profiler.phase('agent_maker'):
+            if self.schedule.time <self.sim_length:
+                self.agent_maker()
+            else: pass
+        with profiler.phase('queue_clearer'):
+            self.queue_clearer(time= self.schedule.time)
         self.kill_agents = []
         #make 1 step
-        self.schedule.step()
+        if self.engine is None:
+            if self.neighbor_index is not None:
+                with profiler.phase('neighbors'):
+                    self.index_neighbors()
+            self.schedule.step()
+        else:
+            self.engine.step()
+        if self.trajectories is not None:
+            with profiler.phase('collect'):
+                self.trajectories.record(self)
         #remove agents that arrived at their destinations
         self.departure += len(self.kill_agents)
         
-        for i in self.kill_agents:
-            self.enroute_del += i.enroute_del
-            self.schedule.remove(i)
-            self.num_agents -= 1
-            self.space.remove_agent(i)
-        try:
-            self.datacollector.collect(self)
-        except: 
-            pass
+        with profiler.phase('removal'):
+            for i in self.kill_agents:
+                self.enroute_del += self.acc.exited(i, self.schedule.time - 1)
+                self.remove_boid(i)
+                self.num_agents -= 1
+        self.tot_del = self.dep_del + self.enroute_del
+        self.acc.end_step()
+        profiler.count('agents', self.num_agents)
+        profiler.count('queue', len(self.queue))
+        profiler.count('removed', len(self.kill_agents))
+        with profiler.phase('collect'):
+            self.mfd.measure(self)
+            if self.zones is not None:
+                self.zones.measure(self)
+            try:
+                self.datacollector.collect(self)
+            except: 
+                pass
+        if self.charts is not None:
+            self.charts.push(self.schedule.steps,
+                             chart_rows(self, self.charts.columns))
+        if self.monitor is not None and self.running:
+            reason = self.monitor.update(self)
+            if reason is not None:
+                self.running = False
+                self.stop_reason = reason
+        profiler.end_step()
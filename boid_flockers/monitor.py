@@ -0,0 +1,186 @@
+"""
+Run monitor
+=============================================================
+Online steady-state and breakdown detection for MFD runs.
+
+The monitor keeps the last 2*window values of occupancy, effective flow and
+queue length in ring buffers with running sums, so every update is O(1).
+Means and variances of the current window are compared with the previous
+window every check_every steps, and the run is stopped (model.running = False,
+model.stop_reason set) when one of these holds:
+
+    "steady state":  the means of occupancy, flow and queue length changed
+                     by less than tol (relative) between the two windows,
+                     or by less than two standard errors of the window
+                     means, so noisy low-demand runs settle as well.
+    "gridlock":      agents are in the box but the mean effective speed
+                     (flow/occupancy) stayed below gridlock_speed.
+    "queue growth":  the queue grew by more than queue_growth (relative)
+                     from one window to the next, for `patience` windows
+                     in a row, and holds more than min_queue agents.
+
+Usage:
+    model = BoidFlockers(rate=200, monitor=True)
+    model = BoidFlockers(rate=200, monitor=dict(window=50, tol=0.05))
+"""
+import numpy as np
+
+
+class RunningWindow:
+    """
+    Ring buffer of the last 2*window values with running sums of the
+    current and the previous window.
+    """
+
+    def __init__(self, window):
+        self.window = window
+        self.values = np.zeros(2*window)
+        self.n = 0
+        self.sums = np.zeros(2)      # previous, current
+        self.squares = np.zeros(2)
+
+    def push(self, value):
+        w = self.window
+        k = self.n % (2*w)
+        if self.n >= w:
+            # The value leaving the current window enters the previous one.
+            moving = self.values[(self.n - w) % (2*w)]
+            self.sums += (moving, -moving)
+            self.squares += (moving**2, -moving**2)
+        if self.n >= 2*w:
+            leaving = self.values[k]
+            self.sums[0] -= leaving
+            self.squares[0] -= leaving**2
+        self.values[k] = value
+        self.sums[1] += value
+        self.squares[1] += value**2
+        self.n += 1
+
+    @property
+    def full(self):
+        return self.n >= 2*self.window
+
+    def mean(self, previous=False):
+        return self.sums[0 if previous else 1]/self.window
+
+    def var(self, previous=False):
+        k = 0 if previous else 1
+        mean = self.sums[k]/self.window
+        return max(self.squares[k]/self.window - mean**2, 0.0)
+
+    def change(self):
+        """
+        Relative change of the mean from the previous to the current window.
+        """
+        previous, current = self.mean(True), self.mean()
+        return (current - previous)/max(abs(previous), 1.0)
+
+    def settled(self, tol):
+        """
+        Whether the mean moved by less than tol (relative) or less than two
+        standard errors between the previous and the current window.
+        """
+        previous, current = self.mean(True), self.mean()
+        noise = 2*np.sqrt((self.var(True) + self.var())/self.window)
+        return abs(current - previous) <= max(tol*abs(previous), noise)
+
+
+class SteadyStateMonitor:
+    """
+    Stops a BoidFlockers run once it is settled or broken down.
+
+    Args:
+        window: Steps per comparison window.
+        min_steps: Steps before any stop is allowed.
+        tol: Relative change between windows accepted as steady.
+        gridlock_speed: Mean effective speed below which a populated box
+                counts as gridlocked, as a fraction of the model speed.
+        queue_growth: Relative queue growth per window counted as diverging.
+        patience: Consecutive diverging windows before stopping.
+        min_queue: Queue length below which growth is never a stop reason.
+        check_every: Steps between checks (the sums update every step).
+    """
+
+    series = ("Occupancy", "Effective flow", "Queue length")
+
+    def __init__(
+            self,
+            window=100,
+            min_steps=300,
+            tol=0.02,
+            gridlock_speed=0.05,
+            queue_growth=0.1,
+            patience=3,
+            min_queue=100,
+            check_every=None):
+        self.window = window
+        self.min_steps = max(min_steps, 2*window)
+        self.tol = tol
+        self.gridlock_speed = gridlock_speed
+        self.queue_growth = queue_growth
+        self.patience = patience
+        self.min_queue = min_queue
+        self.check_every = check_every or window
+        self.stats = {name: RunningWindow(window) for name in self.series}
+        self._growing = 0
+        self.steps = 0
+
+    def update(self, model):
+        """
+        Add the model's current values and check the stop conditions.
+
+        Returns:
+            The stop reason, or None while the run should continue.
+        """
+        values = model.mfd.values
+        self.stats["Occupancy"].push(values.get("Occupancy", 0))
+        self.stats["Effective flow"].push(values.get("Effective flow", 0.0))
+        self.stats["Queue length"].push(len(model.queue))
+        self.steps += 1
+        if self.steps < self.min_steps or self.steps % self.check_every:
+            return None
+        return self.check(model)
+
+    def check(self, model):
+        occupancy = self.stats["Occupancy"]
+        flow = self.stats["Effective flow"]
+        queue = self.stats["Queue length"]
+
+        if occupancy.mean() > 0:
+            speed = flow.mean()/occupancy.mean()
+            if speed < self.gridlock_speed*model.speed:
+                return "gridlock"
+
+        if (queue.change() > self.queue_growth and
+                queue.mean() > self.min_queue):
+            self._growing += 1
+            if self._growing >= self.patience:
+                return "queue growth"
+        else:
+            self._growing = 0
+
+        if all(stats.settled(self.tol) for stats in self.stats.values()):
+            return "steady state"
+        return None
+
+    def summary(self):
+        """
+        Current-window mean and standard deviation of every tracked series.
+        """
+        return {name: (stats.mean(), np.sqrt(stats.var()))
+                for name, stats in self.stats.items()}
+
+
+def make_monitor(monitor):
+    """
+    Build the monitor selected by BoidFlockers(monitor=...): None/False for
+    none, True for the defaults, a dict of SteadyStateMonitor arguments, or
+    a ready monitor object.
+    """
+    if monitor is None or monitor is False:
+        return None
+    if monitor is True:
+        return SteadyStateMonitor()
+    if isinstance(monitor, dict):
+        return SteadyStateMonitor(**monitor)
+    return monitor
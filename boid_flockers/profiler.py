@@ -0,0 +1,111 @@
+"""
+Step profiler
+=============================================================
+Per-phase wall time and counters for BoidFlockers.step.
+
+Each step becomes one row with the seconds spent in every phase (agent
+creation, queue clearing, neighbor queries, MVP resolution, moves, agent
+removal, data collection and the whole step) plus counters such as the
+number of neighbor pairs evaluated and the agents alive. The model holds a
+NullProfiler unless profiling is switched on, whose calls do nothing.
+"""
+import time
+from contextlib import contextmanager
+
+import pandas as pd
+
+
+class NullProfiler:
+    """
+    Profiler interface that records nothing.
+    """
+
+    enabled = False
+
+    def clock(self):
+        return 0
+
+    def start_step(self, step):
+        pass
+
+    def end_step(self):
+        pass
+
+    def add(self, name, seconds):
+        pass
+
+    def count(self, name, n=1):
+        pass
+
+    @contextmanager
+    def phase(self, name):
+        yield
+
+
+class StepProfiler(NullProfiler):
+    """
+    Records one row of phase times and counters per model step.
+    """
+
+    enabled = True
+    phases = ("agent_maker", "queue_clearer", "neighbors", "mvp", "move",
+              "removal", "collect", "step")
+
+    def __init__(self):
+        self.rows = []
+        self._row = None
+        self._start = 0
+
+    def clock(self):
+        return time.perf_counter()
+
+    def start_step(self, step):
+        self._row = dict.fromkeys(self.phases, 0.0)
+        self._row["time"] = step
+        self._start = time.perf_counter()
+
+    def end_step(self):
+        self._row["step"] = time.perf_counter() - self._start
+        self.rows.append(self._row)
+        self._row = None
+
+    def add(self, name, seconds):
+        if self._row is not None:
+            self._row[name] = self._row.get(name, 0.0) + seconds
+
+    def count(self, name, n=1):
+        if self._row is not None:
+            self._row[name] = self._row.get(name, 0) + n
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def table(self):
+        """
+        One row per step: phase times in seconds and the step's counters.
+        """
+        return pd.DataFrame(self.rows).set_index("time")
+
+    def report(self):
+        """
+        Aggregate over all recorded steps: total and mean time per phase and
+        its share of the step time, plus mean counters.
+        """
+        table = self.table()
+        phases = [p for p in self.phases if p in table]
+        times = table[phases]
+        report = pd.DataFrame({
+            "total_s": times.sum(),
+            "mean_ms": times.mean()*1000,
+            "max_ms": times.max()*1000,
+            "share": times.sum()/table["step"].sum()})
+        counters = table.drop(columns=phases)
+        if len(counters.columns):
+            report = pd.concat([report, pd.DataFrame(
+                {"mean": counters.mean(), "max": counters.max()})])
+        return report
@@ -0,0 +1,93 @@
+"""
+Sweep results
+=============================================================
+Lazy, zero-copy access to the per-run tables of a sweep directory.
+
+Sweep workers already write their tables to files and send back only a
+summary row, but load_sweep still parses every file and concatenates them
+into one DataFrame. With fmt="npy" every table is a float64 array that
+np.load memory-maps: opening a run costs no parsing and no copy, and pages
+are only read from disk (or the page cache the worker just wrote them
+through) when they are touched.
+
+    results = open_sweep("results")
+    results.run(3)                    # DataFrame over the mapped array
+    results.column("Effective flow")  # one column of every run
+    results.frame(["Occupancy", "Effective flow"], tail=0.5)
+
+Tables in CSV or Parquet work too, but are read in full on every access.
+"""
+import os
+
+import numpy as np
+import pandas as pd
+
+from .sweep import read_table, run_path
+
+
+class SweepResults:
+    """
+    The runs of a sweep directory, opened on demand.
+
+    Args:
+        out_dir: Directory holding index.csv and the run tables.
+        kind: "model" or "agent" tables.
+    """
+
+    def __init__(self, out_dir, kind="model"):
+        self.out_dir = out_dir
+        self.kind = kind
+        self.index = pd.read_csv(os.path.join(out_dir, "index.csv"))
+        self._tables = {}
+
+    def __len__(self):
+        return len(self.index)
+
+    def path(self, run_id):
+        model_path = self.index.loc[self.index.run_id == run_id,
+                                    "path"].iloc[0]
+        if self.kind == "model":
+            return model_path
+        fmt = os.path.splitext(model_path)[1][1:]
+        return run_path(self.out_dir, run_id, self.kind, fmt)
+
+    def run(self, run_id):
+        """
+        Table of one run; memory-mapped for .npy tables.
+        """
+        if run_id not in self._tables:
+            self._tables[run_id] = read_table(self.path(run_id))
+        return self._tables[run_id]
+
+    def __iter__(self):
+        """
+        (summary row, table) of every run in run_id order.
+        """
+        for _, row in self.index.iterrows():
+            yield row, self.run(row.run_id)
+
+    def column(self, name):
+        """
+        One column of all runs, concatenated in run_id order.
+        """
+        return np.concatenate([table[name].to_numpy()
+                               for _, table in self])
+
+    def frame(self, columns=None, tail=None):
+        """
+        Concatenate the runs into one DataFrame, reading only the given
+        columns and, with tail, the last fraction of every run.
+        """
+        parts = []
+        for row, table in self:
+            if tail is not None:
+                table = table.iloc[int(len(table)*(1 - tail)):]
+            part = table if columns is None else table[list(columns)]
+            part = part.copy()
+            part["sim"] = row.run_id
+            parts.append(part)
+        return pd.concat(parts, ignore_index=True)
+
+
+def open_sweep(out_dir, kind="model"):
+    return SweepResults(out_dir, kind)
@@ -1,9 +1,9 @@
 from mesa.visualization.ModularVisualization import ModularServer
 
 from .model import BoidFlockers
-from .SimpleContinuousModule import SimpleCanvas
+from .SimpleContinuousModule import SimpleCanvas, PackedCanvas
 from mesa.visualization.UserParam import UserSettableParameter
-from mesa.visualization.modules import ChartModule
+from .AggregatedChartModule import AggregatedChartModule
 
 
 def boid_draw(agent):
@@ -40,8 +40,12 @@ def boid_draw(agent):
     # return {"Shape": "circle", "r": 2, "Filled": "true", "Color": "Red"}
 
 boid_canvas = SimpleCanvas(boid_draw, 500, 500)
+# Same picture as boid_canvas, sent as packed arrays (see PackedCanvas).
+packed_canvas = PackedCanvas(500, 500, max_fps=30)
 
 model_params = {
+    # Charts draw from bounded min/mean/max aggregates (see downsample.py).
+    "chart_points": 200,
     # "population": UserSettableParameter(
     #     "slider", "Population", 100, 10, 1000
     # ),
@@ -70,24 +74,24 @@ model_params = {
     )
 }
 
-chart_1 = ChartModule([{"Label": "Occupancy",
+chart_1 = AggregatedChartModule([{"Label": "Occupancy",
                       "Color": "Red"},
                         {"Label": "Queue length",
                        "Color": "Blue"}],
                     data_collector_name='datacollector')
-chart_2 = ChartModule([ {"Label": "Total flow",
+chart_2 = AggregatedChartModule([ {"Label": "Total flow",
                        "Color": "Blue"},
                       {"Label": "Effective flow",
                        "Color": "Green"}],
                     data_collector_name='datacollector')
 
-chart_3 = ChartModule([ {"Label": "Effective speed",
+chart_3 = AggregatedChartModule([ {"Label": "Effective speed",
                        "Color": "Blue"},
                       {"Label": "Speed",
                        "Color": "Green"}],
                     data_collector_name='datacollector')
 
-chart_4 = ChartModule([ {"Label": "Departure Delay",
+chart_4 = AggregatedChartModule([ {"Label": "Departure Delay",
                        "Color": "Blue"},
                       {"Label": "Enroute Delay",
                        "Color": "Green"},
@@ -95,24 +99,29 @@ chart_4 = ChartModule([ {"Label": "Departure Delay",
                        "Color": "Red"}],
                     data_collector_name='datacollector')
 
-chart_5 = ChartModule([  {"Label": "N Arrivals",
+chart_5 = AggregatedChartModule([  {"Label": "N Arrivals",
                        "Color": "Blue"},
                        {"Label": "N Departures",
                        "Color": "Red"}],
                     data_collector_name='datacollector')
 
-chart_7 = ChartModule([  {"Label": "N Conflicts",
+chart_7 = AggregatedChartModule([  {"Label": "N Conflicts",
                        "Color": "Blue"},
                        {"Label": "N Intrusions",
                        "Color": "Red"}],
                     data_collector_name='datacollector')
 
-server = ModularServer(BoidFlockers, [boid_canvas, 
-                                      chart_1,
-                                      chart_2,
-                                      chart_3,
-                                      chart_4,
-                                      chart_5,
-                                      chart_7], "Boids", model_params)
+elements = [packed_canvas, chart_1, chart_2, chart_3, chart_4, chart_5,
+            chart_7]
 
+server = ModularServer(BoidFlockers, elements, "Boids", model_params)
 
+
+def live_server(fps=10, idle_timeout=2, max_steps=None):
+    """
+    Server whose model keeps stepping in the background and is shown at
+    fps frames per second (see live.py).
+    """
+    from .live import LiveServer
+    return LiveServer(BoidFlockers, elements, "Boids", model_params,
+                      fps=fps, idle_timeout=idle_timeout, max_steps=max_steps)
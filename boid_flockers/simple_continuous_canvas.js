@@ -80,4 +80,54 @@ var Simple_Continuous_Module = function(canvas_width, canvas_height) {
 		canvasDraw.resetCanvas();
 	};
 
-};
\ No newline at end of file
+};
+
+var decodeBase64 = function(data) {
+	var binary = atob(data);
+	var bytes = new Uint8Array(binary.length);
+	for (var i = 0; i < binary.length; i++)
+		bytes[i] = binary.charCodeAt(i);
+	return bytes.buffer;
+};
+
+var Packed_Continuous_Module = function(canvas_width, canvas_height, colors, radius) {
+	// Create the element
+	// ------------------
+
+	var canvas_tag = "<canvas width='" + canvas_width + "' height='" + canvas_height + "' ";
+	canvas_tag += "style='border:1px dotted'></canvas>";
+	var canvas = $(canvas_tag)[0];
+	$("#elements").append(canvas);
+	var context = canvas.getContext("2d");
+
+	// Frame from PackedCanvas.render: n agents, base64 little-endian uint16
+	// x/y pairs scaled to 0..65535 and one uint8 color bin per agent.
+	this.render = function(data) {
+		if (data === null || data === undefined)
+			return;	// skipped frame, keep the last one
+		var xy = new Uint16Array(decodeBase64(data.xy));
+		var bins = new Uint8Array(decodeBase64(data.c));
+		var sx = canvas_width / 65535;
+		var sy = canvas_height / 65535;
+
+		context.clearRect(0, 0, canvas_width, canvas_height);
+		// One path per color bin; bin 0 (red) goes first, below the others.
+		for (var b = 0; b < colors.length; b++) {
+			context.beginPath();
+			for (var i = 0; i < data.n; i++) {
+				if (bins[i] != b)
+					continue;
+				var cx = xy[2*i] * sx;
+				var cy = xy[2*i + 1] * sy;
+				context.moveTo(cx + radius, cy);
+				context.arc(cx, cy, radius, 0, Math.PI * 2, false);
+			}
+			context.fillStyle = colors[b];
+			context.fill();
+		}
+	};
+
+	this.reset = function() {
+		context.clearRect(0, 0, canvas_width, canvas_height);
+	};
+};
@@ -0,0 +1,178 @@
+"""
+Streaming sink
+=============================================================
+DataCollector backend that streams model and agent rows to columnar files.
+
+Rows are buffered in memory as usual and flushed every `flush_every` steps
+to Parquet (or Arrow IPC) files partitioned by run:
+
+    <path>/model/run=<run_id>/part-<first step>-<last step>.parquet
+    <path>/agent/run=<run_id>/part-<first step>-<last step>.parquet
+
+so memory stays bounded by one batch no matter how long the run is.
+Every file carries `run` and `step` columns. Numeric reporters are stored
+as float64 (null where a reporter returned None), anything else as strings;
+the column types are fixed by the first batch.
+
+Requires pyarrow.
+"""
+import glob
+import numbers
+import os
+
+import pandas as pd
+from mesa.datacollection import DataCollector
+
+
+def _import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.feather
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError("StreamingDataCollector requires pyarrow")
+    return pyarrow
+
+
+class StreamingDataCollector(DataCollector):
+    """
+    DataCollector that periodically flushes its rows to partitioned files.
+
+    The most recent model row stays in memory after a flush, so reporters
+    that read model_vars[name][-1] (like the ChartModules) keep working.
+    """
+
+    extensions = {"parquet": ".parquet", "arrow": ".arrow"}
+
+    def __init__(
+            self,
+            path,
+            flush_every=100,
+            run_id=0,
+            fmt="parquet",
+            model_reporters=None,
+            agent_reporters=None,
+            tables=None):
+        """
+        Args:
+            path: Directory the partitioned files are written to.
+            flush_every: Number of collected steps buffered per file.
+            run_id: Value of the run partition key.
+            fmt: "parquet" or "arrow" (Arrow IPC / Feather v2).
+            model_reporters, agent_reporters, tables: As for DataCollector.
+        """
+        if fmt not in self.extensions:
+            raise ValueError("Unknown format: {}".format(fmt))
+        self.pa = _import_pyarrow()
+        super().__init__(model_reporters, agent_reporters, tables)
+        self.path = path
+        self.flush_every = flush_every
+        self.run_id = run_id
+        self.fmt = fmt
+
+        self._steps = []
+        self._pending = 0
+        self._schemas = {}
+
+    def collect(self, model):
+        super().collect(model)
+        self._steps.append(model.schedule.steps)
+        if len(self._steps) - self._pending >= self.flush_every:
+            self.flush()
+
+    def _partition(self, kind):
+        directory = os.path.join(self.path, kind, "run={}".format(self.run_id))
+        os.makedirs(directory, exist_ok=True)
+        return directory
+
+    def _column(self, kind, name, values):
+        pa = self.pa
+        key = (kind, name)
+        if key not in self._schemas:
+            numeric = all(v is None or (isinstance(v, numbers.Number) and
+                                        not isinstance(v, bool))
+                          for v in values)
+            self._schemas[key] = pa.float64() if numeric else pa.string()
+        column_type = self._schemas[key]
+        if column_type == pa.string():
+            values = [None if v is None else str(v) for v in values]
+        return pa.array(values, type=column_type, from_pandas=True)
+
+    def _write(self, kind, columns, first, last):
+        pa = self.pa
+        table = pa.table(columns)
+        name = "part-{:08d}-{:08d}{}".format(first, last, self.extensions[self.fmt])
+        path = os.path.join(self._partition(kind), name)
+        if self.fmt == "parquet":
+            pa.parquet.write_table(table, path)
+        else:
+            pa.feather.write_feather(table, path)
+
+    def flush(self):
+        """
+        Write all rows collected since the last flush and drop them from
+        memory.
+        """
+        pa = self.pa
+        steps = self._steps[self._pending:]
+        if not steps:
+            return
+        first, last = steps[0], steps[-1]
+
+        if self.model_reporters:
+            columns = {"run": pa.array([self.run_id]*len(steps), pa.int64()),
+                       "step": pa.array(steps, pa.int64())}
+            for name, values in self.model_vars.items():
+                columns[name] = self._column("model", name,
+                                             values[self._pending:])
+            self._write("model", columns, first, last)
+
+        if self.agent_reporters and self._agent_records:
+            records = [record for step in steps
+                       for record in self._agent_records.get(step, [])]
+            if records:
+                fields = list(zip(*records))
+                columns = {"run": pa.array([self.run_id]*len(records), pa.int64()),
+                           "step": pa.array(fields[0], pa.int64()),
+                           "AgentID": pa.array(fields[1], pa.int64())}
+                for name, values in zip(self.agent_reporters, fields[2:]):
+                    columns[name] = self._column("agent", name, values)
+                self._write("agent", columns, first, last)
+            self._agent_records = {}
+
+        for values in self.model_vars.values():
+            del values[:-1]
+        del self._steps[:-1]
+        self._pending = len(self._steps)
+
+    def close(self):
+        self.flush()
+
+    def get_model_vars_dataframe(self):
+        self.flush()
+        return read_partitions(self.path, "model", self.run_id)
+
+    def get_agent_vars_dataframe(self):
+        self.flush()
+        df = read_partitions(self.path, "agent", self.run_id)
+        return df.set_index(["step", "AgentID"])
+
+
+def read_partitions(path, kind="model", run_id=None):
+    """
+    Read back the model or agent files of one run (or all runs) as a
+    DataFrame ordered by run and step.
+    """
+    pa = _import_pyarrow()
+    run = "*" if run_id is None else run_id
+    pattern = os.path.join(path, kind, "run={}".format(run), "part-*")
+    tables = []
+    for filename in sorted(glob.glob(pattern)):
+        if filename.endswith(".parquet"):
+            tables.append(pa.parquet.read_table(filename))
+        else:
+            tables.append(pa.feather.read_table(filename))
+    if not tables:
+        return pd.DataFrame()
+    df = pa.concat_tables(tables).to_pandas()
+    return df.sort_values(["run", "step"], kind="stable").reset_index(drop=True)
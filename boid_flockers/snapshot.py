@@ -0,0 +1,211 @@
+"""
+Snapshots
+=============================================================
+Save a running BoidFlockers model and restore (or fork) it later.
+
+A snapshot is a directory holding one .npy file per agent field plus a
+state.json with the model parameters, counters, schedule time, both RNG
+states, the cumulative accumulators and the data collection offset:
+
+    <path>/state.json
+    <path>/ids.npy, kinematics.npy, speed.npy, ...
+
+Agent arrays cover placed and queued boids; placed ones come first in
+schedule order, followed by the queue in FIFO order. Arrays are loaded
+memory-mapped, so restoring costs one copy into the new model's arrays.
+Restoring into the vector engine puts every boid back on its saved row and
+restores the free list, so a restored run continues exactly like the
+original one.
+
+Several scenarios can be branched from one warmed-up state:
+
+    save_snapshot(model, "warm")
+    for rate in (100, 200, 300):
+        fork = load_snapshot("warm", rate=rate, seed=rate)
+"""
+import json
+import os
+
+import numpy as np
+
+from .boid import Boid
+from .engine import BoidView
+from .model import BoidFlockers
+
+agent_fields = ('speed', 'od_dist', 'init_time', 'entry_time',
+                'previos_distance', 'current_distance', 'effective_speed',
+                'physic_speed', 'freeflow_endtime', 'enroute_del')
+
+counters = ('unique_id', 'input_rate', 'num_agents', 'arrival', 'departure',
+            'n_confs', 'n_intrusion', 'dep_del', 'enroute_del', 'tot_del',
+            'running', 'stop_reason', '_od_drawn', '_od_valid',
+            '_od_acceptance')
+
+
+def _python(value):
+    """
+    Turn numpy scalars into plain Python values for JSON.
+    """
+    return value.item() if isinstance(value, np.generic) else value
+
+
+def _gather(model):
+    """
+    Collect the state of all placed and queued boids into arrays.
+    """
+    placed = model.schedule.agents
+    agents = placed + list(model.queue)
+    n = len(agents)
+    arrays = {'ids': np.array([a.unique_id for a in agents], dtype=np.int64),
+              'placed': np.arange(n) < len(placed)}
+
+    engine = model.engine
+    if engine is not None:
+        rows = np.array([a.row for a in agents], dtype=np.int64)
+        arrays['rows'] = rows
+        arrays['kinematics'] = engine.kinematics[rows]
+        for name in agent_fields:
+            arrays[name] = getattr(engine, name)[rows]
+        return arrays
+
+    kinematics = np.zeros((n, 6))
+    for k, a in enumerate(agents):
+        kinematics[k] = np.concatenate([a.pos, a.velocity, a.destination])
+    arrays['kinematics'] = kinematics
+    for name in agent_fields:
+        arrays[name] = np.array([getattr(a, name, 0) for a in agents])
+    return arrays
+
+
+def save_snapshot(model, path):
+    """
+    Write the complete state of a model between two steps to path.
+    """
+    os.makedirs(path, exist_ok=True)
+    for name, array in _gather(model).items():
+        np.save(os.path.join(path, name + '.npy'), array)
+
+    params = dict(model.params)
+    params.update(population=model.population, width=model.space.x_max,
+                  height=model.space.y_max, speed=model.speed,
+                  vision=model.vision, separation=model.separation,
+                  rate=model.rate, size_factor=model.size_factor,
+                  sim_length=model.sim_length, angle_min=model.angle_min,
+                  angle_max=model.angle_max)
+
+    version, internal, gauss = model.random.getstate()
+    state = {'params': {k: _python(v) for k, v in params.items()},
+             'counters': {k: _python(getattr(model, k)) for k in counters},
+             'schedule': {'time': model.schedule.time,
+                          'steps': model.schedule.steps},
+             'rng': {'bit_generator': type(model.rng.bit_generator).__name__,
+                     'state': model.rng.bit_generator.state},
+             'random': [version, list(internal), gauss],
+             'data_offset': model.schedule.steps,
+             'accumulators': {'occupancy_time': model.acc.occupancy_time,
+                              'vkt': model.acc.vkt,
+                              'travel_time': model.acc.travel_time,
+                              'completed': model.acc.completed,
+                              'histogram': model.acc.histogram.tolist()}}
+    if model.engine is not None:
+        state['engine'] = {'size': model.engine.size,
+                           'free': list(model.engine.free),
+                           'step_time': model.engine.step_time}
+    with open(os.path.join(path, 'state.json'), 'w') as f:
+        json.dump(state, f)
+
+
+def load_snapshot(path, seed=None, **overrides):
+    """
+    Rebuild a model from a snapshot.
+
+    Args:
+        path: Snapshot directory written by save_snapshot.
+        seed: If given, the restored model draws from a fresh RNG seeded
+                with it instead of continuing the saved RNG streams, so
+                forks of the same snapshot diverge.
+        overrides: BoidFlockers arguments replacing the saved ones, e.g.
+                rate for a scenario branch, or sink/run_id/profile.
+
+    Returns:
+        The restored model. Its data collector starts empty; data_offset
+        holds the number of steps collected before the snapshot.
+    """
+    with open(os.path.join(path, 'state.json')) as f:
+        state = json.load(f)
+    arrays = {}
+    for filename in os.listdir(path):
+        if filename.endswith('.npy'):
+            arrays[filename[:-4]] = np.load(os.path.join(path, filename),
+                                            mmap_mode='r')
+
+    params = dict(state['params'])
+    params.update(overrides)
+    model = BoidFlockers(seed=seed, **params)
+
+    for name, value in state['counters'].items():
+        setattr(model, name, value)
+    model.schedule.time = state['schedule']['time']
+    model.schedule.steps = state['schedule']['steps']
+    model.data_offset = state['data_offset']
+    if seed is None:
+        bit_generator = getattr(np.random, state['rng']['bit_generator'])()
+        bit_generator.state = state['rng']['state']
+        model.rng = np.random.Generator(bit_generator)
+        version, internal, gauss = state['random']
+        model.random.setstate((version, tuple(internal), gauss))
+
+    if model.engine is not None:
+        _restore_vector(model, state, arrays)
+    else:
+        _restore_agents(model, arrays)
+    # Box totals were rebuilt by placing the boids; the cumulative ones are
+    # restored (per-flight records are not part of a snapshot).
+    for name, value in state['accumulators'].items():
+        setattr(model.acc, name, value)
+    model.acc.histogram = np.array(model.acc.histogram, dtype=np.int64)
+    return model
+
+
+def _restore_vector(model, state, arrays):
+    engine = model.engine
+    n = len(arrays['ids'])
+    if 'rows' in arrays and 'engine' in state:
+        rows = np.asarray(arrays['rows'])
+        size = state['engine']['size']
+        free = list(state['engine']['free'])
+        engine.step_time = state['engine']['step_time']
+    else:
+        rows = np.arange(n)
+        size, free = n, []
+    if size > engine.capacity:
+        engine._grow(size)
+    engine.size = size
+    engine.free = free
+
+    engine.kinematics[rows] = arrays['kinematics']
+    for name in agent_fields:
+        getattr(engine, name)[rows] = arrays[name]
+    for unique_id, row, placed in zip(arrays['ids'], rows, arrays['placed']):
+        boid = BoidView(int(unique_id), model, int(row))
+        engine.agents[row] = boid
+        if placed:
+            model.place_boid(boid)
+        else:
+            model.queue.append(boid)
+
+
+def _restore_agents(model, arrays):
+    kinematics = np.asarray(arrays['kinematics'])
+    for k, unique_id in enumerate(arrays['ids']):
+        boid = Boid(unique_id=int(unique_id), model=model,
+                    pos=kinematics[k, 0:2].copy(), speed=model.speed,
+                    velocity=kinematics[k, 2:4].copy(),
+                    destination=kinematics[k, 4:6].copy(),
+                    vision=model.vision, separation=model.separation)
+        for name in agent_fields:
+            setattr(boid, name, arrays[name][k].item())
+        if arrays['placed'][k]:
+            model.place_boid(boid)
+        else:
+            model.queue.append(boid)
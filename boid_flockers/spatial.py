@@ -0,0 +1,211 @@
+"""
+Neighbor index
+=============================================================
+Batched radius queries for the Flockers model.
+
+ContinuousSpace.get_neighbors scans every agent for every query, which makes
+a step O(N^2). The indexes here are rebuilt once per step from the current
+positions and answer the radius queries of all agents in one call. Results
+are CSR-style neighbor lists: the neighbors of query point k are
+indices[indptr[k]:indptr[k + 1]], as rows of the indexed position array.
+
+Like get_neighbors with include_center=False, points at distance exactly
+zero from the query point are left out.
+"""
+import itertools
+
+import numpy as np
+
+
+def to_csr(query, found, n_queries):
+    """
+    Turn (query, found) index pairs into CSR neighbor lists.
+    """
+    order = np.argsort(query, kind='stable')
+    indices = found[order]
+    indptr = np.zeros(n_queries + 1, dtype=np.intp)
+    np.cumsum(np.bincount(query, minlength=n_queries), out=indptr[1:])
+    return indptr, indices
+
+
+def csr_pairs(indptr, indices):
+    """
+    Expand CSR neighbor lists into (query, neighbor) index arrays.
+    """
+    counts = np.diff(indptr)
+    return np.repeat(np.arange(len(counts)), counts), indices
+
+
+def pairs_within(pos, radius, chunk=1024):
+    """
+    Find all ordered pairs (i, j) with 0 < |pos[i] - pos[j]| <= radius.
+
+    Same neighbor test as ContinuousSpace.get_neighbors with
+    include_center=False. Works on blocks of rows to bound memory.
+    """
+    n = len(pos)
+    own, intruder = [], []
+    for start in range(0, n, chunk):
+        d = pos[start:start + chunk, None, :] - pos[None, :, :]
+        d2 = d[..., 0]**2 + d[..., 1]**2
+        i, j = np.nonzero((d2 <= radius**2) & (d2 > 0))
+        own.append(i + start)
+        intruder.append(j)
+    if n == 0:
+        return np.zeros(0, dtype=np.intp), np.zeros(0, dtype=np.intp)
+    return np.concatenate(own), np.concatenate(intruder)
+
+
+class GridIndex:
+    """
+    Uniform grid with square cells, stored as points sorted by cell key.
+
+    A radius query only visits the cells within ceil(radius/cell_size) of
+    the query cell, so with cell_size close to the query radius the cost
+    per query is proportional to the local density.
+    """
+
+    def __init__(self, cell_size):
+        if cell_size <= 0:
+            raise ValueError("cell_size must be positive")
+        self.cell_size = cell_size
+        self.pos = np.zeros((0, 2))
+
+    def _cells(self, points):
+        return np.floor((points - self.origin)/self.cell_size).astype(np.int64)
+
+    def build(self, pos):
+        """
+        Index the (N,2) array of positions.
+        """
+        self.pos = np.asarray(pos, dtype=float).reshape(-1, 2)
+        if len(self.pos) == 0:
+            self.origin = np.zeros(2)
+            self.shape = (0, 0)
+            self.order = np.zeros(0, dtype=np.intp)
+            self.keys = np.zeros(0, dtype=np.int64)
+            return self
+        self.origin = self.pos.min(axis=0)
+        cells = self._cells(self.pos)
+        self.shape = tuple(cells.max(axis=0) + 1)
+        keys = cells[:, 0]*self.shape[1] + cells[:, 1]
+        self.order = np.argsort(keys, kind='stable')
+        self.keys = keys[self.order]
+        return self
+
+    def query(self, points, radius, include_center=False):
+        """
+        Find the indexed points within radius of each query point.
+
+        Returns:
+            (indptr, indices) CSR neighbor lists.
+        """
+        points = np.asarray(points, dtype=float).reshape(-1, 2)
+        n = len(points)
+        if n == 0 or len(self.pos) == 0:
+            return np.zeros(n + 1, dtype=np.intp), np.zeros(0, dtype=np.intp)
+
+        rings = int(np.ceil(radius/self.cell_size))
+        qcells = self._cells(points)
+        nx, ny = self.shape
+        query, found = [], []
+        for dx in range(-rings, rings + 1):
+            cx = qcells[:, 0] + dx
+            for dy in range(-rings, rings + 1):
+                cy = qcells[:, 1] + dy
+                valid = np.flatnonzero((cx >= 0) & (cx < nx) &
+                                       (cy >= 0) & (cy < ny))
+                keys = cx[valid]*ny + cy[valid]
+                start = np.searchsorted(self.keys, keys, side='left')
+                counts = np.searchsorted(self.keys, keys, side='right') - start
+                total = counts.sum()
+                if total == 0:
+                    continue
+                offsets = (np.arange(total) -
+                           np.repeat(np.cumsum(counts) - counts, counts))
+                query.append(np.repeat(valid, counts))
+                found.append(self.order[np.repeat(start, counts) + offsets])
+
+        if not query:
+            return np.zeros(n + 1, dtype=np.intp), np.zeros(0, dtype=np.intp)
+        query = np.concatenate(query)
+        found = np.concatenate(found)
+        deltas = points[query] - self.pos[found]
+        dists = deltas[:, 0]**2 + deltas[:, 1]**2
+        hit = dists <= radius**2
+        if not include_center:
+            hit &= dists > 0
+        return to_csr(query[hit], found[hit], n)
+
+    def pairs(self, radius):
+        """
+        Unordered pairs (i, j), i < j, of indexed points within radius.
+        """
+        i, j = csr_pairs(*self.query(self.pos, radius))
+        once = i < j
+        return i[once], j[once]
+
+
+class KDTreeIndex:
+    """
+    Radius queries through scipy's cKDTree.
+    """
+
+    def __init__(self):
+        try:
+            from scipy.spatial import cKDTree
+        except ImportError:
+            raise ImportError("KDTreeIndex requires scipy")
+        self._tree_class = cKDTree
+        self.pos = np.zeros((0, 2))
+
+    def build(self, pos):
+        self.pos = np.asarray(pos, dtype=float).reshape(-1, 2)
+        self.tree = self._tree_class(self.pos) if len(self.pos) else None
+        return self
+
+    def query(self, points, radius, include_center=False):
+        points = np.asarray(points, dtype=float).reshape(-1, 2)
+        n = len(points)
+        if n == 0 or self.tree is None:
+            return np.zeros(n + 1, dtype=np.intp), np.zeros(0, dtype=np.intp)
+
+        lists = self.tree.query_ball_point(points, radius)
+        counts = np.fromiter(map(len, lists), dtype=np.intp, count=n)
+        found = np.fromiter(itertools.chain.from_iterable(lists),
+                            dtype=np.intp, count=counts.sum())
+        query = np.repeat(np.arange(n), counts)
+        if not include_center:
+            deltas = points[query] - self.pos[found]
+            hit = deltas[:, 0]**2 + deltas[:, 1]**2 > 0
+            query, found = query[hit], found[hit]
+        return to_csr(query, found, n)
+
+    def pairs(self, radius):
+        """
+        Unordered pairs (i, j), i < j, of indexed points within radius.
+        """
+        if self.tree is None:
+            return np.zeros(0, dtype=np.intp), np.zeros(0, dtype=np.intp)
+        pairs = self.tree.query_pairs(radius, output_type='ndarray')
+        i, j = pairs[:, 0], pairs[:, 1]
+        deltas = self.pos[i] - self.pos[j]
+        apart = deltas[:, 0]**2 + deltas[:, 1]**2 > 0
+        return i[apart], j[apart]
+
+
+def make_index(kind, radius, separation):
+    """
+    Create the neighbor index selected by BoidFlockers(neighbor_index=...).
+
+    The grid's cell size is tied to radius, the radius of the per-step
+    queries (vision, or vision + 2*speed on the agent engine), so that
+    those only visit the 3x3 surrounding cells. 'kdtree' requires scipy.
+    """
+    if kind is None:
+        return None
+    if kind == 'grid':
+        return GridIndex(max(radius, separation) or 1)
+    if kind == 'kdtree':
+        return KDTreeIndex()
+    raise ValueError("Unknown neighbor index: {}".format(kind))
@@ -0,0 +1,210 @@
+"""
+Parallel sweeps
+=============================================================
+Process-pool runner for MFD parameter sweeps.
+
+Every combination of the variable parameters is run `iterations` times.
+Runs get deterministic seeds derived from the sweep seed and their run id,
+so results do not depend on the number of workers or on scheduling order.
+Each worker writes its run's model time series to its own file as soon as
+the run finishes; only a small summary row travels back to the parent.
+With fmt="npy" the file is a plain float64 array the parent memory-maps
+instead of parsing (see results.py).
+"""
+import itertools
+import json
+import os
+from multiprocessing import Pool
+
+import numpy as np
+import pandas as pd
+
+from .model import BoidFlockers
+
+
+def sweep_grid(variable_params, fixed_params=None, iterations=1, seed=0):
+    """
+    Expand the sweep into a list of run descriptions.
+
+    Args:
+        variable_params: Dict of BoidFlockers argument name to list of values,
+                e.g. {"rate": [20, 40], "vision": [4], "separation": [1, 2]}.
+        fixed_params: Dict of BoidFlockers arguments shared by all runs.
+        iterations: Number of replications of every parameter combination.
+        seed: Sweep seed the per-run seeds are derived from.
+    """
+    fixed_params = fixed_params or {}
+    names = list(variable_params)
+    combos = list(itertools.product(*[variable_params[n] for n in names]))
+    seeds = np.random.SeedSequence(seed).spawn(len(combos)*iterations)
+
+    runs = []
+    for run_id, (combo, iteration) in enumerate(
+            itertools.product(combos, range(iterations))):
+        params = dict(fixed_params)
+        params.update(zip(names, combo))
+        runs.append({"run_id": run_id,
+                     "iteration": iteration,
+                     "seed": int(seeds[run_id].generate_state(1)[0]),
+                     "params": params})
+    return runs
+
+
+def run_path(out_dir, run_id, kind="model", fmt="csv"):
+    return os.path.join(out_dir, "{}_{:06d}.{}".format(kind, run_id, fmt))
+
+
+def write_table(frame, path):
+    """
+    Write a run's table as CSV or, for a .parquet path, as Parquet.
+
+    A .npy path gets the values as one float64 array, with the column names
+    in a .json file next to it; the index is stored as leading columns
+    unless it is the default range.
+    """
+    if path.endswith(".npy"):
+        if not isinstance(frame.index, pd.RangeIndex):
+            frame = frame.reset_index()
+        np.save(path, frame.to_numpy(dtype=float, na_value=np.nan))
+        with open(path[:-len(".npy")] + ".json", "w") as f:
+            json.dump({"columns": [str(c) for c in frame.columns]}, f)
+    elif path.endswith(".parquet"):
+        frame.to_parquet(path)
+    else:
+        frame.to_csv(path)
+
+
+def read_table(path):
+    """
+    Read a table written by write_table. A .npy table is memory-mapped and
+    wrapped without copying.
+    """
+    if path.endswith(".npy"):
+        with open(path[:-len(".npy")] + ".json") as f:
+            columns = json.load(f)["columns"]
+        return pd.DataFrame(np.load(path, mmap_mode="r"), columns=columns,
+                            copy=False)
+    if path.endswith(".parquet"):
+        return pd.read_parquet(path)
+    return pd.read_csv(path, index_col=0)
+
+
+def run_model(run, max_steps):
+    """
+    Run one sweep point to max_steps (or until the model stops).
+
+    With a streaming sink, the run's rows go to the run=<run_id> partition,
+    so all runs of a sweep can share one sink directory. Trajectories go to
+    a run_<run_id> store inside the given directory, which is closed (and
+    indexed) when the run ends.
+    """
+    params = dict(run["params"])
+    if params.get("sink") is not None:
+        params["run_id"] = run["run_id"]
+    if params.get("trajectories") is not None:
+        params["trajectories"] = os.path.join(
+            params["trajectories"], "run_{:06d}".format(run["run_id"]))
+    model = BoidFlockers(seed=run["seed"], **params)
+    while model.running and model.schedule.steps < max_steps:
+        model.step()
+    if model.trajectories is not None:
+        model.trajectories.close()
+    return model
+
+
+def tail_means(model_vars, tail=0.5):
+    """
+    Mean occupancy and effective flow over the last `tail` fraction of a
+    run's time series, i.e. its (approximately) settled part.
+    """
+    if len(model_vars) == 0:
+        return {"occupancy": np.nan, "flow": np.nan}
+    settled = model_vars.iloc[int(len(model_vars)*(1 - tail)):]
+    return {"occupancy": float(settled["Occupancy"].mean()),
+            "flow": float(settled["Effective flow"].mean())}
+
+
+def _run_task(task):
+    run, max_steps, out_dir, agent_data, fmt = task
+    model = run_model(run, max_steps)
+    path = run_path(out_dir, run["run_id"], fmt=fmt)
+
+    model_vars = model.datacollector.get_model_vars_dataframe()
+    model_vars["time"] = model_vars.index
+    model_vars["sim"] = run["run_id"]
+    write_table(model_vars, path)
+    if agent_data:
+        agent_vars = model.datacollector.get_agent_vars_dataframe()
+        agent_vars["time"] = agent_vars.index.get_level_values(0)
+        agent_vars["sim"] = run["run_id"]
+        write_table(agent_vars, run_path(out_dir, run["run_id"], "agent", fmt))
+
+    summary = {"run_id": run["run_id"],
+               "iteration": run["iteration"],
+               "seed": run["seed"],
+               "steps": model.schedule.steps,
+               "stop_reason": model.stop_reason,
+               "path": path}
+    summary.update(tail_means(model_vars))
+    summary.update(run["params"])
+    return summary
+
+
+def run_sweep(
+        variable_params,
+        fixed_params=None,
+        iterations=1,
+        max_steps=1200,
+        out_dir="sweep_output",
+        workers=None,
+        chunksize=None,
+        seed=0,
+        agent_data=False,
+        fmt="csv"):
+    """
+    Run a parameter sweep on a process pool.
+
+    Args:
+        variable_params, fixed_params, iterations, seed: See sweep_grid.
+        max_steps: Steps to run each model for.
+        out_dir: Directory the per-run files and index.csv go to.
+        workers: Number of worker processes (default: all cores).
+        chunksize: Runs handed to a worker at a time. Defaults to about four
+                chunks per worker, which keeps workers busy while limiting
+                scheduling overhead.
+        agent_data: Also write every run's agent-level time series.
+        fmt: "csv", "parquet" or "npy" for the per-run files.
+
+    Returns:
+        DataFrame with one row per run: parameters, seed and result path.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    runs = sweep_grid(variable_params, fixed_params, iterations, seed)
+    workers = workers or os.cpu_count() or 1
+    if chunksize is None:
+        chunksize = max(1, len(runs)//(4*workers))
+
+    tasks = [(run, max_steps, out_dir, agent_data, fmt) for run in runs]
+    summaries = []
+    with Pool(workers) as pool:
+        for summary in pool.imap_unordered(_run_task, tasks, chunksize):
+            summaries.append(summary)
+
+    index = pd.DataFrame(summaries).sort_values("run_id")
+    index = index.reset_index(drop=True)
+    index.to_csv(os.path.join(out_dir, "index.csv"), index=False)
+    return index
+
+
+def load_sweep(out_dir, kind="model"):
+    """
+    Read back the model time series of all runs in a sweep directory, or
+    with kind="agent" their agent time series (written with agent_data).
+    """
+    index = pd.read_csv(os.path.join(out_dir, "index.csv"))
+    paths = index.path
+    if kind != "model":
+        paths = [run_path(out_dir, run_id, kind, os.path.splitext(path)[1][1:])
+                 for run_id, path in zip(index.run_id, index.path)]
+    return pd.concat([read_table(path) for path in paths],
+                     ignore_index=True)
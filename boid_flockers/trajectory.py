@@ -0,0 +1,201 @@
+"""
+Trajectory store
+=============================================================
+Agent trajectories in a memory-mapped file, indexed by agent and by step.
+
+BoidFlockers(trajectories="run_traj") appends one fixed-width record per
+airborne boid and step to a binary file while the run goes on:
+
+    step  id  x  y  vx  vy  speed        (int64, int64, 5 x float64)
+
+Steps are numbered like the DataCollector's agent rows, and a boid's last
+record is the step it reached its destination in.
+
+Records of a step are contiguous and steps are in order, so a time window
+is one slice of the file. On close the writer adds two indexes next to the
+records: the offset of every step, and the records of every agent in
+record order (a CSR list over the ids). TrajectoryStore maps the file and
+answers both kinds of query by reading only the records involved:
+
+    store = TrajectoryStore("run_traj")
+    store.agent(1234)              # one flight, in step order
+    store.window(500, 600)         # all boids in steps 500..599
+    store.frame(store.window(500, 501))
+
+A store that was not closed (e.g. a run still in progress) is readable
+too; its indexes are then built from the records when first needed. A
+store holds one run: in a sweep, every run writes its own store
+<path>/run_<run_id> and closes it when it ends (see sweep.run_model).
+
+    run_traj/records.bin, steps.npy, agent_ids.npy, agent_ptr.npy,
+             agent_order.npy
+"""
+import os
+
+import numpy as np
+import pandas as pd
+
+record_dtype = np.dtype([('step', '<i8'), ('id', '<i8'), ('x', '<f8'),
+                         ('y', '<f8'), ('vx', '<f8'), ('vy', '<f8'),
+                         ('speed', '<f8')])
+
+files = ('records.bin', 'steps.npy', 'agent_ids.npy', 'agent_ptr.npy',
+         'agent_order.npy')
+
+
+def trajectory_records(model, step):
+    """
+    Records of all placed boids of a model.
+    """
+    if model.engine is not None:
+        engine = model.engine
+        rows = engine.active()
+        records = np.empty(len(rows), dtype=record_dtype)
+        records['id'] = np.fromiter((a.unique_id for a in engine.agents[rows]),
+                                    dtype=np.int64, count=len(rows))
+        records['x'], records['y'] = engine.pos[rows].T
+        records['vx'], records['vy'] = engine.velocity[rows].T
+        records['speed'] = engine.physic_speed[rows]
+    else:
+        agents = model.schedule.agents
+        records = np.empty(len(agents), dtype=record_dtype)
+        records['id'] = [a.unique_id for a in agents]
+        state = np.array([(a.pos[0], a.pos[1], a.velocity[0], a.velocity[1],
+                           a.physic_speed) for a in agents],
+                         dtype=float).reshape(-1, 5)
+        for k, name in enumerate(('x', 'y', 'vx', 'vy', 'speed')):
+            records[name] = state[:, k]
+    records['step'] = step
+    return records
+
+
+class TrajectoryWriter:
+    """
+    Appends the records of every step to <path>/records.bin.
+
+    Args:
+        path: Store directory; an existing store there is replaced.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        for name in files:
+            if os.path.exists(os.path.join(path, name)):
+                os.remove(os.path.join(path, name))
+        self.file = open(os.path.join(path, 'records.bin'), 'wb')
+        self.steps = []
+        self.offsets = []
+        self.n = 0
+
+    def write(self, records):
+        """
+        Append the records of one step (all with the same step number).
+        """
+        if len(records):
+            self.steps.append(int(records['step'][0]))
+            self.offsets.append(self.n)
+            self.file.write(records.tobytes())
+            self.file.flush()
+            self.n += len(records)
+
+    def record(self, model):
+        self.write(trajectory_records(model, model.schedule.steps))
+
+    def close(self):
+        """
+        Finish the file and write the step and agent indexes.
+        """
+        if self.file.closed:
+            return
+        self.file.close()
+        np.save(os.path.join(self.path, 'steps.npy'),
+                np.array([self.steps, self.offsets], dtype=np.int64).reshape(
+                    2, -1))
+        ids = np.zeros(0, dtype=np.int64)
+        if self.n:
+            ids = np.memmap(os.path.join(self.path, 'records.bin'),
+                            dtype=record_dtype, mode='r')['id']
+        for name, array in zip(('agent_ids', 'agent_ptr', 'agent_order'),
+                               agent_index(np.asarray(ids))):
+            np.save(os.path.join(self.path, name + '.npy'), array)
+
+
+def agent_index(ids):
+    """
+    CSR index of records by agent: the records of agent_ids[k] are
+    agent_order[agent_ptr[k]:agent_ptr[k + 1]], in record (step) order.
+    """
+    order = np.argsort(ids, kind='stable')
+    agent_ids, counts = np.unique(ids[order], return_counts=True)
+    ptr = np.zeros(len(agent_ids) + 1, dtype=np.int64)
+    np.cumsum(counts, out=ptr[1:])
+    return agent_ids, ptr, order
+
+
+class TrajectoryStore:
+    """
+    Read access to a trajectory store directory.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        size = os.path.getsize(os.path.join(path, 'records.bin'))
+        n = size//record_dtype.itemsize
+        self.records = (np.memmap(os.path.join(path, 'records.bin'),
+                                  dtype=record_dtype, mode='r', shape=(n,))
+                        if n else np.zeros(0, dtype=record_dtype))
+        self._steps = self._load('steps')
+        self._agents = None
+
+    def __len__(self):
+        return len(self.records)
+
+    def _load(self, name):
+        path = os.path.join(self.path, name + '.npy')
+        return np.load(path, mmap_mode='r') if os.path.exists(path) else None
+
+    @property
+    def steps(self):
+        """
+        (steps, offsets): every recorded step and its first record.
+        """
+        if self._steps is None:
+            step = np.asarray(self.records['step'])
+            start = np.flatnonzero(np.r_[True, step[1:] != step[:-1]])
+            self._steps = np.stack([step[start], start])
+        return self._steps[0], self._steps[1]
+
+    def window(self, start, stop=None):
+        """
+        Records of steps start <= step < stop, as a view into the file.
+        """
+        steps, offsets = self.steps
+        stop = start + 1 if stop is None else stop
+        bounds = np.append(offsets, len(self.records))
+        first = bounds[np.searchsorted(steps, start, side='left')]
+        last = bounds[np.searchsorted(steps, stop, side='left')]
+        return self.records[first:last]
+
+    def agent(self, unique_id):
+        """
+        Records of one agent in step order.
+        """
+        if self._agents is None:
+            index = [self._load(n)
+                     for n in ('agent_ids', 'agent_ptr', 'agent_order')]
+            if index[0] is None:
+                index = agent_index(np.asarray(self.records['id']))
+            self._agents = index
+        agent_ids, ptr, order = self._agents
+        k = np.searchsorted(agent_ids, unique_id)
+        if k == len(agent_ids) or agent_ids[k] != unique_id:
+            return self.records[:0]
+        return self.records[np.asarray(order[ptr[k]:ptr[k + 1]])]
+
+    @staticmethod
+    def frame(records):
+        """
+        DataFrame of a set of records.
+        """
+        return pd.DataFrame(np.asarray(records))
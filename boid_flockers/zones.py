@@ -0,0 +1,250 @@
+"""
+Measurement zones
+=============================================================
+Per-region MFD quantities for studying spatial heterogeneity.
+
+A Zones object splits the airspace into measurement regions, either a
+regular grid over a box or a list of polygons, and maps positions to region
+ids. Every step ZoneRecorder bins all airborne boids by region id once and
+sums their contributions with np.bincount, so measuring any number of
+regions costs about as much as measuring the single center box:
+
+    model = BoidFlockers(zones=(4, 4))              # 4x4 grid, center box
+    model = BoidFlockers(zones={"grid": (8, 8), "box": (0, 100, 0, 100)})
+    model = BoidFlockers(zones={"polygons": [[(40, 40), (60, 40), (50, 60)],
+                                             ...]})
+    ...
+    model.zones.array()      # (steps, regions, metrics)
+    model.zones.to_frame()   # one row per step and region
+
+The metrics of a region are, per step:
+
+    occupancy    boids in the region
+    flow         sum of their physical speeds
+    eff_flow     sum of their effective speeds
+    speed        flow/occupancy (NaN for an empty region)
+    conflicts    conflicts detected by those boids this step
+    intrusions   intrusions detected by those boids this step
+
+A boid counts in the region of its end-of-step position. In the 'pairwise'
+conflict mode every conflict is shared half-half between both aircraft, so
+the regions still add up to the model's N Conflicts except for boids that
+reached their destination in the step.
+"""
+import numpy as np
+import pandas as pd
+
+from .metrics import measurement_box
+
+
+class Zones:
+    """
+    Region layout: maps (N,2) positions to region ids, -1 outside every
+    region.
+
+    Use Zones.grid or Zones.polygons to build one.
+    """
+
+    def __init__(self, names, grid=None, polygons=None):
+        self.names = list(names)
+        self._grid = grid
+        self._polygons = polygons
+
+    def __len__(self):
+        return len(self.names)
+
+    @classmethod
+    def grid(cls, box, nx, ny=None):
+        """
+        nx by ny equal cells over box = (x_lo, x_hi, y_lo, y_hi). Cells are
+        numbered row by row from the lower left, named "x<i>y<j>".
+        """
+        ny = nx if ny is None else ny
+        names = ["x{}y{}".format(i, j) for j in range(ny) for i in range(nx)]
+        return cls(names, grid=(tuple(float(b) for b in box), nx, ny))
+
+    @classmethod
+    def polygons(cls, polygons, names=None):
+        """
+        One region per polygon, given as a sequence of (x, y) vertices.
+        Where polygons overlap, a position belongs to the first one.
+        """
+        polygons = [np.asarray(p, dtype=float).reshape(-1, 2)
+                    for p in polygons]
+        if names is None:
+            names = ["zone{}".format(k) for k in range(len(polygons))]
+        if len(names) != len(polygons):
+            raise ValueError("Need one name per polygon")
+        return cls(names, polygons=polygons)
+
+    def region_ids(self, pos):
+        """
+        Region id of every position, -1 outside every region.
+        """
+        pos = np.asarray(pos, dtype=float).reshape(-1, 2)
+        if self._grid is not None:
+            return self._grid_ids(pos)
+        return self._polygon_ids(pos)
+
+    def _grid_ids(self, pos):
+        (x_lo, x_hi, y_lo, y_hi), nx, ny = self._grid
+        inside = ((pos[:, 0] >= x_lo) & (pos[:, 0] <= x_hi) &
+                  (pos[:, 1] >= y_lo) & (pos[:, 1] <= y_hi))
+        # The upper edges belong to the last cell, as in in_box.
+        i = np.minimum(((pos[:, 0] - x_lo)*nx/(x_hi - x_lo)).astype(np.intp),
+                       nx - 1)
+        j = np.minimum(((pos[:, 1] - y_lo)*ny/(y_hi - y_lo)).astype(np.intp),
+                       ny - 1)
+        return np.where(inside, j*nx + i, -1)
+
+    def _polygon_ids(self, pos):
+        ids = np.full(len(pos), -1, dtype=np.intp)
+        for k in range(len(self._polygons) - 1, -1, -1):
+            ids[point_in_polygon(pos, self._polygons[k])] = k
+        return ids
+
+
+def point_in_polygon(pos, vertices):
+    """
+    Even-odd test of (N,2) positions against one polygon, vectorized over
+    the positions; positions outside its bounding box are skipped.
+    """
+    lo, hi = vertices.min(axis=0), vertices.max(axis=0)
+    candidates = np.flatnonzero(np.all((pos >= lo) & (pos <= hi), axis=1))
+    x, y = pos[candidates, 0], pos[candidates, 1]
+    inside = np.zeros(len(candidates), dtype=bool)
+    x1, y1 = vertices[-1]
+    for x2, y2 in vertices:
+        crosses = (y1 > y) != (y2 > y)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            x_cross = x1 + (y - y1)*(x2 - x1)/(y2 - y1)
+        inside ^= crosses & (x < x_cross)
+        x1, y1 = x2, y2
+    result = np.zeros(len(pos), dtype=bool)
+    result[candidates] = inside
+    return result
+
+
+def zone_arrays(model):
+    """
+    Positions and the (N,4) physical speed, effective speed, conflict and
+    intrusion counts of all placed boids.
+    """
+    if model.engine is not None:
+        engine = model.engine
+        rows = engine.active()
+        values = np.stack([engine.physic_speed[rows],
+                           engine.effective_speed[rows],
+                           engine.n_conf[rows], engine.n_intrusion[rows]],
+                          axis=1)
+        return engine.pos[rows], values
+
+    state = np.array([(agent.pos[0], agent.pos[1], agent.physic_speed,
+                       agent.effective_speed, agent.n_conf, agent.n_intrusion)
+                      for agent in model.schedule.agents],
+                     dtype=float).reshape(-1, 6)
+    return state[:, :2], state[:, 2:]
+
+
+class ZoneRecorder:
+    """
+    Per-step, per-region metrics of a model run.
+
+    Args:
+        zones: The Zones layout.
+        capacity: Initial number of steps the buffer holds; it doubles when
+                full.
+    """
+
+    metrics = ("occupancy", "flow", "eff_flow", "speed", "conflicts",
+               "intrusions")
+
+    def __init__(self, zones, capacity=256):
+        self.zones = zones
+        self.steps = np.zeros(capacity, dtype=np.int64)
+        self.values = np.zeros((capacity, len(zones), len(self.metrics)))
+        self.n = 0
+
+    def measure(self, model):
+        """
+        Bin the current population by region and append one step.
+        """
+        pos, values = zone_arrays(model)
+        n_regions = len(self.zones)
+        # Slot 0 collects everything outside the regions and is dropped.
+        ids = self.zones.region_ids(pos) + 1
+        occupancy = np.bincount(ids, minlength=n_regions + 1)[1:]
+        sums = [np.bincount(ids, weights=values[:, k],
+                            minlength=n_regions + 1)[1:]
+                for k in range(values.shape[1])]
+
+        if self.n == len(self.steps):
+            self._grow(2*len(self.steps))
+        row = self.values[self.n]
+        row[:, 0] = occupancy
+        row[:, 1] = sums[0]
+        row[:, 2] = sums[1]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            row[:, 3] = np.where(occupancy > 0, sums[0]/occupancy, np.nan)
+        row[:, 4] = sums[2]
+        row[:, 5] = sums[3]
+        self.steps[self.n] = model.schedule.steps
+        self.n += 1
+
+    def _grow(self, capacity):
+        steps = np.zeros(capacity, dtype=np.int64)
+        steps[:self.n] = self.steps[:self.n]
+        values = np.zeros((capacity,) + self.values.shape[1:])
+        values[:self.n] = self.values[:self.n]
+        self.steps, self.values = steps, values
+
+    def array(self):
+        """
+        (steps, regions, metrics) array of everything recorded so far (a
+        view; copy it to keep it past the next step).
+        """
+        return self.values[:self.n]
+
+    def to_frame(self):
+        """
+        Long DataFrame with one row per step and region.
+        """
+        n_regions = len(self.zones)
+        frame = pd.DataFrame(self.array().reshape(-1, len(self.metrics)),
+                             columns=self.metrics)
+        frame.insert(0, "zone", np.tile(self.zones.names, self.n))
+        frame.insert(0, "step", np.repeat(self.steps[:self.n], n_regions))
+        return frame
+
+    def save(self, path):
+        """
+        Write the array with its step, zone and metric labels to an .npz.
+        """
+        np.savez(path, values=self.array(), steps=self.steps[:self.n],
+                 zones=np.array(self.zones.names),
+                 metrics=np.array(self.metrics))
+
+
+def make_zones(zones, model):
+    """
+    Build the recorder selected by BoidFlockers(zones=...): None for none,
+    an int n or (nx, ny) for a grid over the center measurement box, a dict
+    with "grid" (plus an optional "box") or "polygons" (plus optional
+    "names"), or a ready Zones object.
+    """
+    if zones is None or zones is False:
+        return None
+    if isinstance(zones, Zones):
+        return ZoneRecorder(zones)
+    if isinstance(zones, dict):
+        if "polygons" in zones:
+            return ZoneRecorder(Zones.polygons(zones["polygons"],
+                                               zones.get("names")))
+        box = zones.get("box") or measurement_box(model)
+        shape = zones["grid"]
+    else:
+        box = measurement_box(model)
+        shape = zones
+    if np.ndim(shape) == 0:
+        shape = (shape, shape)
+    return ZoneRecorder(Zones.grid(box, *shape))
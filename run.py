@@ -1,4 +1,16 @@
-from boid_flockers.server import server
+import argparse
 
-server.launch()
+from boid_flockers.server import server, live_server
 
+parser = argparse.ArgumentParser(description="Boids visualization server.")
+parser.add_argument("--live", action="store_true",
+                    help="step the model in the background instead of on "
+                         "every browser request")
+parser.add_argument("--fps", type=float, default=10,
+                    help="frames per second sent in --live mode")
+parser.add_argument("--port", type=int, default=None)
+args = parser.parse_args()
+
+if args.live:
+    server = live_server(fps=args.fps)
+server.launch(port=args.port)